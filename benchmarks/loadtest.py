@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Load test for metroserver.py: keep-alive clients firing random /route queries.
+#
+#   python metroserver.py &
+#   python benchmarks/loadtest.py [--city moscow] [--concurrency 32] [--requests 5000] [--batch 0]
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+async def request(reader, writer, host, method, target, body=b''):
+    writer.write('{} {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\n\r\n'.format(
+        method, target, host, len(body)).encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def client(args, ids, count, latencies, errors):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        for _ in range(count):
+            if args.batch:
+                pairs = [random.sample(ids, 2) for _ in range(args.batch)]
+                body = json.dumps({'city': args.city, 'pairs': pairs}).encode('utf-8')
+                started = time.perf_counter()
+                status, _ = await request(reader, writer, args.host, 'POST', '/route', body)
+            else:
+                src, dst = random.sample(ids, 2)
+                started = time.perf_counter()
+                status, _ = await request(reader, writer, args.host, 'GET',
+                                          '/route?city={}&from={}&to={}'.format(args.city, src, dst))
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(args):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    status, body = await request(reader, writer, args.host, 'GET', '/stations?city={}'.format(args.city))
+    writer.close()
+    if status != 200:
+        raise SystemExit('Cant list stations of {}: {}'.format(args.city, body.decode('utf-8')))
+    ids = [station['id'] for station in json.loads(body.decode('utf-8'))]
+
+    latencies = []
+    errors = []
+    per_client = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                  for i in range(args.concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*[client(args, ids, count, latencies, errors) for count in per_client if count])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    routes = len(latencies) * (args.batch or 1)
+    print(json.dumps({
+        'requests': len(latencies),
+        'routes': routes,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'routes_per_second': round(routes / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure metroserver.py latency and throughput')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--city', default='moscow')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=0, help='pairs per POST /route, 0 sends single GETs')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Resident size of many network snapshots: the __slots__ classes against the
+# previous plain __dict__ objects with OrderedDict station maps.
+#
+#   python benchmarks/memory.py [--city moscow] [--snapshots 50]
+import argparse
+import collections
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generatemetro  # noqa: E402
+
+
+class DictStation(object):
+    def __init__(self, id, name, x, y, lat, lon):
+        self.id = id
+        self.name = name
+        self.x = x
+        self.y = y
+        self.lat = lat
+        self.lon = lon
+
+
+class DictLine(object):
+    def __init__(self, id, name, color):
+        self.id = id
+        self.name = name
+        self.color = color
+        self.stations = collections.OrderedDict()
+
+
+def build_dict_lines(definition):
+    lines = collections.OrderedDict()
+    for line in definition['lines']:
+        lines[line['id']] = DictLine(line['id'], line['name'], line['color'])
+        for row in line['stations'] + line.get('branch', []):
+            lines[line['id']].stations[row[0]] = DictStation(*row)
+    return lines
+
+
+def build_slots_lines(definition):
+    lines = {}
+    for line in definition['lines']:
+        lines[line['id']] = generatemetro.MetroLine(line['id'], line['name'], line['color'])
+        lines[line['id']].AddStations(line['stations'] + line.get('branch', []))
+    return lines
+
+
+def measure(build, definition, snapshots):
+    gc.collect()
+    tracemalloc.start()
+    kept = [build(definition) for _ in range(snapshots)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare memory of network snapshots')
+    parser.add_argument('--city', default='moscow')
+    parser.add_argument('--snapshots', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(generatemetro.CITIES_DIR, '{}.json'.format(args.city))
+    with open(path, encoding='utf-8') as f:
+        definition = json.load(f)
+    stations = sum(len(line['stations']) + len(line.get('branch', [])) for line in definition['lines'])
+
+    # station/line objects only, so the comparison is not skewed by the edge arrays
+    legacy = measure(build_dict_lines, definition, args.snapshots)
+    slots = measure(build_slots_lines, definition, args.snapshots)
+    full = measure(generatemetro.build_metro, definition, args.snapshots)
+    for label, size in (('__dict__ + OrderedDict', legacy), ('__slots__ + dict', slots), ('full Metro', full)):
+        print('{:<24} {:>10} bytes  {:>6.0f} bytes/station'.format(
+            label, size, size / float(stations * args.snapshots)))
+    print('saving: {:.0f}%'.format(100. * (legacy - slots) / legacy))
+
+
+if __name__ == '__main__':
+    main()
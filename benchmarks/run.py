@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Benchmarks for network build, edge times, serialization, loading and queries, on the real
+# cities and on synthetic networks made of many shifted copies of one of them.
+#
+#   python benchmarks/run.py [--cities moscow,piter] [--scales 1,10,100] [--filter route]
+#                            [--output results.json] [--compare old.json]
+#
+# Results are written to benchmarks/results/<git revision>.json unless --output is given;
+# --compare prints the ratio against an earlier results file.
+import argparse
+import copy
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generatemetro  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def load_definition(city):
+    with open(os.path.join(generatemetro.CITIES_DIR, '{}.json'.format(city)), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def synthetic_definition(definition, scale):
+    # scale copies of the city on a grid 0.5 degrees apart, each copy connected to the next one
+    # by a change between their first stations
+    if scale == 1:
+        return definition
+    result = copy.deepcopy(definition)
+    result['id'] = '{}_x{}'.format(definition['id'], scale)
+    result['lines'] = []
+    result['changes'] = []
+    result['times'] = []
+    side = int(scale ** 0.5 + 0.999)
+    first = None
+    for copy_index in range(scale):
+        suffix = '_{}'.format(copy_index)
+        dlat = (copy_index // side) * 0.5
+        dlon = (copy_index % side) * 0.5
+
+        def shift(rows):
+            return [[row[0] + suffix, row[1], row[2], row[3], row[4] + dlat, row[5] + dlon] for row in rows]
+
+        for line in definition['lines']:
+            shifted = dict(line, id=line['id'] + suffix, stations=shift(line['stations']))
+            if 'branch' in line:
+                shifted['branch'] = shift(line['branch'])
+            result['lines'].append(shifted)
+        result['changes'].extend([[a + suffix, b + suffix] + rest for a, b, *rest in definition.get('changes', ())])
+        result['times'].extend([[a + suffix, b + suffix] + rest for a, b, *rest in definition.get('times', ())])
+        station = definition['lines'][0]['stations'][0][0] + suffix
+        if first is not None:
+            result['changes'].append([first, station, 600])
+        first = station
+    return result
+
+
+def measure(function, repeat, setup=None):
+    # seconds per call, best and median of repeat calls; setup() runs untimed and its
+    # result is passed to function
+    timings = []
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        started = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - started)
+    return {'best': min(timings), 'median': statistics.median(timings), 'repeat': repeat}
+
+
+def unfilled_metro(definition):
+    # the network with stations and changes but no ride times, for timing FillDefaultTimes alone
+    metro = generatemetro.Metro(definition['id'], definition['name'], definition['accusative_name'])
+    for line in definition['lines']:
+        metro.AddLine(line['id'], line['name'], line['color']).AddStations(line['stations'])
+    return metro
+
+
+def cases(definition, scale, rng):
+    # (case, function, repeat, setup or None)
+    metro = generatemetro.build_metro(definition)
+    ids = list(metro._ids)
+    pairs = [tuple(rng.sample(ids, 2)) for _ in range(200)]
+    points = [metro.GetStation(id) for id in rng.sample(ids, min(50, len(ids)))]
+    points = [(station.lat + rng.uniform(-0.01, 0.01), station.lon + rng.uniform(-0.01, 0.01)) for station in points]
+    # autocomplete prefixes of station names and names with one letter dropped
+    names = [metro.GetStation(id).name for id in rng.sample(ids, min(50, len(ids)))]
+    queries = [name[:rng.randint(2, len(name))] for name in names[::2]] + \
+              [name[:i] + name[i + 1:] for name in names[1::2] for i in [rng.randrange(len(name))]]
+    exported = generatemetro.json_repr(metro)
+    directory = tempfile.mkdtemp(prefix='metro-bench-')
+    binary = os.path.join(directory, 'metro.mbin')
+    generatemetro.write_metro_binary(metro, binary)
+    big = scale >= 10
+
+    def routes():
+        for src, dst in pairs:
+            metro.Route(src, dst)
+
+    def fast_routes():
+        for src, dst in pairs:
+            metro.FastRoute(src, dst)
+
+    def search():
+        for query in queries:
+            metro.Search(query, 10)
+
+    def nearest():
+        for lat, lon in points:
+            metro.Nearest(lat, lon, 5)
+
+    def k_shortest():
+        for src, dst in pairs[:20]:
+            metro.KShortestRoutes(src, dst, 3)
+
+    def isochrones():
+        list(metro._Isochrones(range(min(20, len(ids))), [600, 1200, 1800]))
+
+    def load_binary():
+        with generatemetro.MetroBinary(binary) as reader:
+            reader.StationIndex(ids[-1])
+
+    yield 'build', lambda: generatemetro.build_metro(definition), 1 if big else 5, None
+    yield 'fill_default_times', lambda unfilled: unfilled.FillDefaultTimes(definition.get('speed', 41)), \
+        1 if big else 5, lambda: unfilled_metro(definition)
+    yield 'json_dump', lambda: generatemetro.json_dump(metro, io.StringIO()), 3, None
+    yield 'json_repr', lambda: generatemetro.json_repr(metro), 3, None
+    yield 'json_load', lambda: json.loads(exported), 3, None
+    yield 'binary_write', lambda: generatemetro.write_metro_binary(metro, os.path.join(directory, 'out.mbin')), \
+        3, None
+    yield 'binary_open', load_binary, 20, None
+    yield 'route_x200', routes, 1 if big else 3, None
+    yield 'contraction_build', lambda: generatemetro.build_contraction_hierarchy(metro), 1 if big else 3, None
+    metro.ContractionHierarchy()
+    yield 'fast_route_x200', fast_routes, 3, None
+    yield 'nearest_x{}'.format(len(points)), nearest, 3, None
+    yield 'search_build', lambda: generatemetro.StationSearch(
+        metro.id, ids, [station.name for station in metro._nodes],
+        generatemetro.search_keys(ids, [station.name for station in metro._nodes])), 1 if big else 3, None
+    metro.SearchIndex()
+    yield 'search_x{}'.format(len(queries)), search, 3, None
+    yield 'isochrones_x20', isochrones, 1 if big else 3, None
+    if not big:
+        yield 'k_shortest_x20', k_shortest, 3, None
+    shutil.rmtree(directory)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, path):
+    with open(path, encoding='utf-8') as f:
+        previous = {(entry['network'], entry['case']): entry for entry in json.load(f)['results']}
+    for entry in results:
+        old = previous.get((entry['network'], entry['case']))
+        if old is not None:
+            print('{:<24} {:<24} {:>7.2f}x'.format(entry['network'], entry['case'],
+                                                   entry['best'] / old['best'] if old['best'] else float('inf')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark network build, serialization and queries')
+    parser.add_argument('--cities', default='moscow', help='comma separated cities')
+    parser.add_argument('--scales', default='1,10', help='comma separated synthetic network sizes, e.g. 1,10,100')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=None, help='override the number of repeats')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='results file, benchmarks/results/<revision>.json by default')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    results = []
+    for city in args.cities.split(','):
+        for scale in [int(value) for value in args.scales.split(',')]:
+            definition = synthetic_definition(load_definition(city), scale)
+            network = definition['id']
+            stations = sum(len(line['stations']) + len(line.get('branch', [])) for line in definition['lines'])
+            rng = random.Random(args.seed)
+            for case, function, repeat, setup in cases(definition, scale, rng):
+                if args.filter not in case:
+                    continue
+                timing = measure(function, args.repeat or repeat, setup)
+                timing.update(network=network, stations=stations, case=case)
+                results.append(timing)
+                print('{:<24} {:<24} {:>12.3f} ms  (median {:.3f} ms)'.format(
+                    network, case, timing['best'] * 1000, timing['median'] * 1000))
+                sys.stdout.flush()
+
+    revision = git_revision()
+    output = args.output or os.path.join(RESULTS_DIR, '{}.json'.format(revision))
+    directory = os.path.dirname(os.path.abspath(output))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'revision': revision, 'python': platform.python_version(), 'machine': platform.machine(),
+                   'numpy': generatemetro.numpy is not None, 'time': int(time.time()), 'results': results},
+                  f, indent=2)
+    print('results written to {}'.format(output))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,32 @@
 # -*- coding: utf-8 -*-
-import math
+import argparse
+import array
+import bisect
 import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import cProfile
+import filecmp
+import functools
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import mmap
 import os
+import re
+import stat
+import struct
+import sys
+import tempfile
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def distance(llat1, llong1, llat2, llong2):
@@ -24,34 +48,815 @@ def distance(llat1, llong1, llat2, llong2):
     return dist
 
 
+def distances(lats1, lons1, lats2, lons2):
+    # element-wise distance() over coordinate sequences, scalars are broadcast;
+    # returns a numpy array when numpy is installed and a list otherwise
+    if numpy is not None:
+        lat1 = numpy.asarray(lats1, dtype=numpy.float64) * math.pi / 180.
+        lat2 = numpy.asarray(lats2, dtype=numpy.float64) * math.pi / 180.
+        long1 = numpy.asarray(lons1, dtype=numpy.float64) * math.pi / 180.
+        long2 = numpy.asarray(lons2, dtype=numpy.float64) * math.pi / 180.
+        cl1 = numpy.cos(lat1)
+        cl2 = numpy.cos(lat2)
+        sl1 = numpy.sin(lat1)
+        sl2 = numpy.sin(lat2)
+        delta = long2 - long1
+        cdelta = numpy.cos(delta)
+        sdelta = numpy.sin(delta)
+        y = numpy.sqrt((cl2 * sdelta) ** 2 + (cl1 * sl2 - sl1 * cl2 * cdelta) ** 2)
+        x = sl1 * sl2 + cl1 * cl2 * cdelta
+        return numpy.arctan2(y, x) * 6372795
+    columns = [itertools.repeat(column) if isinstance(column, (int, float)) else column
+               for column in (lats1, lons1, lats2, lons2)]
+    if all(isinstance(column, itertools.repeat) for column in columns):
+        return [distance(lats1, lons1, lats2, lons2)]
+    return [distance(*point) for point in zip(*columns)]
+
+
+def travel_time(dist, metrospeed=41):
+    # seconds to ride dist meters at metrospeed km/h, rounded to 10 seconds
+    return int(round(dist / (metrospeed * 1000) * 60 * 60 / 10) * 10)
+
+
+class Instrumentation(object):
+    # per-phase wall time and event counters of the build pipeline; phases are inclusive,
+    # build_metro also contains the AddTime/AddChange/FillDefaultTimes it runs
+    def __init__(self):
+        self.phases = collections.defaultdict(lambda: [0, 0.])
+        self.counters = collections.Counter()
+
+    @contextlib.contextmanager
+    def Phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase = self.phases[name]
+            phase[0] += 1
+            phase[1] += time.perf_counter() - started
+
+    def Count(self, name, count=1):
+        self.counters[name] += count
+
+    def Merge(self, snapshot):
+        for name, phase in snapshot['phases'].items():
+            self.phases[name][0] += phase['calls']
+            self.phases[name][1] += phase['seconds']
+        self.counters.update(snapshot['counters'])
+
+    def Snapshot(self):
+        return {'phases': {name: {'calls': calls, 'seconds': round(seconds, 6)}
+                           for name, (calls, seconds) in sorted(self.phases.items())},
+                'counters': dict(sorted(self.counters.items()))}
+
+
+# the active Instrumentation; None keeps every hook down to one global lookup
+_instrumentation = None
+
+
+def enable_instrumentation():
+    global _instrumentation
+    _instrumentation = Instrumentation()
+    return _instrumentation
+
+
+def disable_instrumentation():
+    global _instrumentation
+    instrumentation, _instrumentation = _instrumentation, None
+    return instrumentation
+
+
+def _phase(name):
+    return _instrumentation.Phase(name) if _instrumentation is not None else contextlib.nullcontext()
+
+
+def _timed(phase):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _instrumentation is None:
+                return function(*args, **kwargs)
+            with _instrumentation.Phase(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def iter_json(obj):
+    # walks the objects directly and yields json.dumps-compatible chunks, nothing is copied
+    if isinstance(obj, str):
+        yield json.encoder.encode_basestring_ascii(obj)
+    elif obj is None:
+        yield 'null'
+    elif obj is True:
+        yield 'true'
+    elif obj is False:
+        yield 'false'
+    elif isinstance(obj, int):
+        yield int.__repr__(obj)
+    elif isinstance(obj, float):
+        yield json.dumps(obj)
+    elif isinstance(obj, (collections.abc.Mapping, BasicObj)):
+        if isinstance(obj, collections.abc.Mapping):
+            items = obj.items()
+        else:
+            items = ((key, getattr(obj, key)) for key in obj._json_fields)
+        separator = '{'
+        for key, value in items:
+            yield separator + json.encoder.encode_basestring_ascii(key) + ': '
+            yield from iter_json(value)
+            separator = ', '
+        yield '{}' if separator == '{' else '}'
+    elif isinstance(obj, (list, tuple)):
+        separator = '['
+        for item in obj:
+            yield separator
+            yield from iter_json(item)
+            separator = ', '
+        yield '[]' if separator == '[' else ']'
+    else:
+        yield json.encoder.encode_basestring_ascii(repr(obj))
+
+
+@_timed('json_dump')
+def json_dump(obj, f, buffer_size=1024):
+    chunks = []
+    for chunk in iter_json(obj):
+        chunks.append(chunk)
+        if len(chunks) >= buffer_size:
+            f.write(''.join(chunks))
+            del chunks[:]
+    f.write(''.join(chunks))
+
+
+@_timed('json_repr')
 def json_repr(obj, indent=None):
-    def serialize(obj):
-        # if isinstance(obj, (bool, int, long, float, basestring)):
-        if isinstance(obj, (bool, int, float, str)):
-            return obj
-        elif isinstance(obj, dict):
-            obj = obj.copy()
-            for key in obj:
-                obj[key] = serialize(obj[key])
-            return obj
-        elif isinstance(obj, list):
-            return [serialize(item) for item in obj]
-        elif isinstance(obj, tuple):
-            return tuple(serialize([item for item in obj]))
-        elif hasattr(obj, '__dict__'):
-            return serialize(obj.__dict__)
+    text = ''.join(iter_json(obj))
+    if indent is not None:
+        text = json.dumps(json.loads(text, object_pairs_hook=collections.OrderedDict), indent=indent)
+    return text
+
+
+class AtomicWriter(object):
+    # writes to a temporary file next to path and only replaces path if the content differs
+    def __init__(self, path, mode='w', encoding=None):
+        self.path = path
+        self.mode = mode
+        self.encoding = encoding
+        self.changed = False
+        self._file = None
+
+    def __enter__(self):
+        directory, name = os.path.split(os.path.abspath(self.path))
+        self._file = tempfile.NamedTemporaryFile(self.mode, encoding=self.encoding, dir=directory,
+                                                 prefix='.{}.'.format(name), suffix='.tmp', delete=False)
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        temp = self._file.name
+        if exc_type is not None:
+            os.remove(temp)
+            return False
+        if os.path.exists(self.path) and filecmp.cmp(temp, self.path, shallow=False):
+            os.remove(temp)
+            return False
+        if os.path.exists(self.path):
+            os.chmod(temp, stat.S_IMODE(os.stat(self.path).st_mode))
         else:
-            return repr(obj)
-    return json.dumps(serialize(obj), indent=indent)
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp, 0o666 & ~umask)
+        if _instrumentation is not None:
+            _instrumentation.Count('bytes_written', os.path.getsize(temp))
+        os.replace(temp, self.path)
+        self.changed = True
+        return False
+
+
+def _write_ids(f, ids):
+    # station ids as a <H length and UTF-8 bytes each; returns the number of bytes written
+    size = 0
+    for id in ids:
+        encoded = id.encode('utf-8')
+        f.write(struct.pack('<H', len(encoded)))
+        f.write(encoded)
+        size += 2 + len(encoded)
+    return size
+
+
+def _read_ids(buf, offset, count):
+    # count ids written by _write_ids at offset, and the offset right after them
+    ids = []
+    for _ in range(count):
+        length, = struct.unpack_from('<H', buf, offset)
+        ids.append(bytes(buf[offset + 2:offset + 2 + length]).decode('utf-8'))
+        offset += 2 + length
+    return ids, offset
+
+
+class _MappedFile(object):
+    # read-only memory mapping of an exported file, closed with the reader
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+MATRIX_MAGIC = b'MTRX'
+MATRIX_VERSION = 1
+MATRIX_UNREACHABLE = 0xFFFFFFFF
+# magic, version, station count
+MATRIX_HEADER = struct.Struct('<4sII')
+
+
+def write_time_matrix(metro, path):
+    ids, cells = metro.AllPairsTimes()
+    if sys.byteorder != 'little':
+        cells.byteswap()
+    writer = AtomicWriter(path, 'wb')
+    with writer as f:
+        f.write(MATRIX_HEADER.pack(MATRIX_MAGIC, MATRIX_VERSION, len(ids)))
+        size = MATRIX_HEADER.size + _write_ids(f, ids)
+        # keep the cells 4-byte aligned so readers can cast the mapping directly
+        f.write(b'\0' * (-size % 4))
+        cells.tofile(f)
+    return writer.changed
+
+
+class TimeMatrix(_MappedFile):
+    def __init__(self, path):
+        super(TimeMatrix, self).__init__(path)
+        magic, version, count = MATRIX_HEADER.unpack_from(self._mmap, 0)
+        if magic != MATRIX_MAGIC or version != MATRIX_VERSION:
+            raise MetroError("'{}' is not a version {} time matrix".format(path, MATRIX_VERSION))
+        self.ids, offset = _read_ids(self._mmap, MATRIX_HEADER.size, count)
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self._offset = offset + (-offset % 4)
+        self._count = count
+
+    def _Index(self, id):
+        try:
+            return self.index[id]
+        except KeyError:
+            raise UnknownStationError(id)
+
+    def Time(self, src, dst):
+        cell = self._Index(src) * self._count + self._Index(dst)
+        time, = struct.unpack_from('<I', self._mmap, self._offset + cell * 4)
+        return None if time == MATRIX_UNREACHABLE else time
+
+    def Row(self, src):
+        start = self._offset + self._Index(src) * self._count * 4
+        row = struct.unpack_from('<{}I'.format(self._count), self._mmap, start)
+        return {id: time for id, time in zip(self.ids, row) if time != MATRIX_UNREACHABLE}
+
+
+BINARY_MAGIC = b'MTRB'
+BINARY_VERSION = 1
+# magic, version, station count, line count, ride count, transfer count, string count, Metro.station_count,
+# metro id/name/accusative_name strings, offsets of the string offsets, string data, lines, stations,
+# sorted id order, rides and transfers sections
+BINARY_HEADER = struct.Struct('<4sI6I3I7I')
+# id, name, color strings
+BINARY_LINE = struct.Struct('<3I')
+# id, name strings, x, y, lat, lon, line index, padding to keep the doubles aligned
+BINARY_STATION = struct.Struct('<2I2i2dII')
+# src, dst, seconds
+BINARY_EDGE = struct.Struct('<3I')
+
+StationRecord = collections.namedtuple('StationRecord', ['id', 'name', 'x', 'y', 'lat', 'lon', 'line'])
+LineRecord = collections.namedtuple('LineRecord', ['id', 'name', 'color'])
+
+
+def write_metro_binary(metro, path):
+    strings = []
+    string_index = {}
+
+    def intern(value):
+        if value not in string_index:
+            string_index[value] = len(strings)
+            strings.append(value.encode('utf-8'))
+        return string_index[value]
+
+    header_strings = [intern(metro.id), intern(metro.name), intern(metro.accusative_name)]
+    line_index = {}
+    lines = []
+    for line in metro.lines.values():
+        line_index[line.id] = len(lines)
+        lines.append(BINARY_LINE.pack(intern(line.id), intern(line.name), intern(line.color)))
+    stations = [BINARY_STATION.pack(intern(station.id), intern(station.name), station.x, station.y,
+                                    station.lat, station.lon, line_index[line.id], 0)
+                for station, line in zip(metro._nodes, metro._node_lines)]
+    order = sorted(range(len(metro._ids)), key=lambda i: strings[string_index[metro._ids[i]]])
+
+    sections = []
+    offsets = [0]
+    for size in itertools.accumulate(len(value) for value in strings):
+        offsets.append(size)
+    sections.append(struct.pack('<{}I'.format(len(offsets)), *offsets))
+    sections.append(b''.join(strings))
+    sections.append(b''.join(lines))
+    sections.append(b''.join(stations))
+    sections.append(struct.pack('<{}I'.format(len(order)), *order))
+    for edges in (metro._rides, metro._transfers):
+        sections.append(b''.join(BINARY_EDGE.pack(*edge) for edge in zip(edges.src, edges.dst, edges.weight)))
+
+    section_offsets = []
+    position = BINARY_HEADER.size
+    for i, section in enumerate(sections):
+        # 8-byte aligned sections, padding goes to the end of the previous one
+        padding = -position % 8
+        if padding:
+            sections[i - 1] += b'\0' * padding
+            position += padding
+        section_offsets.append(position)
+        position += len(section)
+
+    writer = AtomicWriter(path, 'wb')
+    with writer as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(metro._ids), len(lines), len(metro._rides),
+                                   len(metro._transfers), len(strings), metro.station_count,
+                                   *(header_strings + section_offsets)))
+        for section in sections:
+            f.write(section)
+    return writer.changed
+
+
+class MetroBinary(_MappedFile):
+    # memory-mapped reader of write_metro_binary files; records are decoded on access only
+    def __init__(self, path):
+        super(MetroBinary, self).__init__(path)
+        header = BINARY_HEADER.unpack_from(self._mmap, 0)
+        if header[0] != BINARY_MAGIC or header[1] != BINARY_VERSION:
+            raise MetroError("'{}' is not a version {} metro binary".format(path, BINARY_VERSION))
+        (self.station_count, self.line_count, self.ride_count, self.transfer_count,
+         self._string_count, self.total_station_count) = header[2:8]
+        self._metro_strings = header[8:11]
+        (self._string_offsets, self._string_data, self._lines, self._stations,
+         self._order, self._rides, self._transfers) = header[11:]
+
+    def __len__(self):
+        return self.station_count
+
+    @property
+    def id(self):
+        return self.String(self._metro_strings[0])
+
+    @property
+    def name(self):
+        return self.String(self._metro_strings[1])
+
+    @property
+    def accusative_name(self):
+        return self.String(self._metro_strings[2])
+
+    def _StringBytes(self, i):
+        start, end = struct.unpack_from('<2I', self._mmap, self._string_offsets + i * 4)
+        return self._mmap[self._string_data + start:self._string_data + end]
+
+    def String(self, i):
+        return self._StringBytes(i).decode('utf-8')
+
+    def Line(self, i):
+        if not 0 <= i < self.line_count:
+            raise IndexError(i)
+        return LineRecord(*map(self.String, BINARY_LINE.unpack_from(self._mmap, self._lines + i * BINARY_LINE.size)))
+
+    def Station(self, i):
+        if not 0 <= i < self.station_count:
+            raise IndexError(i)
+        id, name, x, y, lat, lon, line, _ = BINARY_STATION.unpack_from(self._mmap, self._stations + i * BINARY_STATION.size)
+        return StationRecord(self.String(id), self.String(name), x, y, lat, lon, line)
+
+    def StationIndex(self, id):
+        # binary search over the station indices sorted by id
+        key = id.encode('utf-8')
+        lo, hi = 0, self.station_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i, = struct.unpack_from('<I', self._mmap, self._order + mid * 4)
+            station_id, = struct.unpack_from('<I', self._mmap, self._stations + i * BINARY_STATION.size)
+            value = self._StringBytes(station_id)
+            if value == key:
+                return i
+            if value < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        raise UnknownStationError(id)
+
+    def _Edges(self, offset, count):
+        for i in range(count):
+            yield BINARY_EDGE.unpack_from(self._mmap, offset + i * BINARY_EDGE.size)
+
+    def Rides(self):
+        # (src index, dst index, seconds) of every ride segment, each stored once
+        return self._Edges(self._rides, self.ride_count)
+
+    def Transfers(self):
+        return self._Edges(self._transfers, self.transfer_count)
+
+    def ToMetro(self):
+        metro = Metro(self.id, self.name, self.accusative_name)
+        lines = [metro.AddLine(*self.Line(i)) for i in range(self.line_count)]
+        for i in range(self.station_count):
+            station = self.Station(i)
+            lines[station.line].AddStation(*station[:-1])
+        for src, dst, weight in self.Rides():
+            metro._rides.Set(src, dst, weight)
+        for src, dst, weight in self.Transfers():
+            metro._transfers.Set(src, dst, weight)
+        metro.station_count = self.total_station_count
+        return metro
+
+
+ISOCHRONE_MAGIC = b'MTRI'
+ISOCHRONE_VERSION = 1
+ISOCHRONE_OUTSIDE = 255
+# magic, version, station count, source count, threshold count
+ISOCHRONE_HEADER = struct.Struct('<4s4I')
+DEFAULT_ISOCHRONE_MINUTES = (5, 10, 15, 20, 30, 45, 60)
+
+
+def _isochrone_thresholds(thresholds):
+    thresholds = sorted(thresholds)
+    if not 0 < len(thresholds) < ISOCHRONE_OUTSIDE:
+        raise MetroError('Between 1 and {} isochrone thresholds are supported'.format(ISOCHRONE_OUTSIDE - 1))
+    return thresholds
+
+
+def write_isochrones(metro, path, thresholds=None, sources=None):
+    # thresholds in seconds; one byte per (source, station): index of the first threshold
+    # the station is reached within, ISOCHRONE_OUTSIDE if it is further than the last one
+    if thresholds is None:
+        thresholds = [minutes * 60 for minutes in DEFAULT_ISOCHRONE_MINUTES]
+    thresholds = _isochrone_thresholds(thresholds)
+    ids = metro._ids
+    source_indices = list(range(len(ids))) if sources is None else [metro._index[id] for id in sources]
+    writer = AtomicWriter(path, 'wb')
+    with writer as f:
+        f.write(ISOCHRONE_HEADER.pack(ISOCHRONE_MAGIC, ISOCHRONE_VERSION, len(ids), len(source_indices),
+                                      len(thresholds)))
+        f.write(struct.pack('<{}I'.format(len(thresholds)), *thresholds))
+        _write_ids(f, ids)
+        f.write(struct.pack('<{}I'.format(len(source_indices)), *source_indices))
+        for _, buckets in metro._Isochrones(source_indices, thresholds):
+            f.write(buckets)
+    return writer.changed
+
+
+class Isochrones(_MappedFile):
+    def __init__(self, path):
+        super(Isochrones, self).__init__(path)
+        magic, version, count, source_count, threshold_count = ISOCHRONE_HEADER.unpack_from(self._mmap, 0)
+        if magic != ISOCHRONE_MAGIC or version != ISOCHRONE_VERSION:
+            raise MetroError("'{}' is not a version {} isochrone file".format(path, ISOCHRONE_VERSION))
+        offset = ISOCHRONE_HEADER.size
+        self.thresholds = struct.unpack_from('<{}I'.format(threshold_count), self._mmap, offset)
+        self.ids, offset = _read_ids(self._mmap, offset + threshold_count * 4, count)
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        sources = struct.unpack_from('<{}I'.format(source_count), self._mmap, offset)
+        self._rows = {source: i for i, source in enumerate(sources)}
+        self._offset = offset + source_count * 4
+        self._count = count
+
+    def _Row(self, src):
+        if src not in self.index:
+            raise UnknownStationError(src)
+        row = self._rows.get(self.index[src])
+        if row is None:
+            raise MetroError("No isochrones for station '{}'".format(src))
+        start = self._offset + row * self._count
+        return self._mmap[start:start + self._count]
+
+    def Buckets(self, src):
+        # {threshold seconds: [station ids first reached within it]}
+        buckets = collections.OrderedDict((threshold, []) for threshold in self.thresholds)
+        for id, bucket in zip(self.ids, self._Row(src)):
+            if bucket != ISOCHRONE_OUTSIDE:
+                buckets[self.thresholds[bucket]].append(id)
+        return buckets
+
+    def Reachable(self, src, seconds):
+        # station ids reachable from src within the largest threshold not above seconds
+        limit = bisect.bisect_right(self.thresholds, seconds)
+        return [id for id, bucket in zip(self.ids, self._Row(src)) if bucket < limit]
+
+
+CONTRACTION_MAGIC = b'MTRH'
+CONTRACTION_VERSION = 1
+# magic, version, station count, upward edge count
+CONTRACTION_HEADER = struct.Struct('<4s3I')
+# middle station of an upward edge that is an original ride segment or change rather than a shortcut
+CONTRACTION_RIDE = -1
+CONTRACTION_CHANGE = -2
+# stations settled by one witness search before a shortcut is added anyway
+CONTRACTION_WITNESS_SETTLED = 500
+
+
+def _witness_search(adjacency, src, skip, limit, targets):
+    # upper bounds of the distances from src to targets not passing through skip
+    dist = {src: 0}
+    heap = [(0, src)]
+    settled = 0
+    remaining = len(targets)
+    while heap and settled < CONTRACTION_WITNESS_SETTLED:
+        time, station = heapq.heappop(heap)
+        if time > dist[station]:
+            continue
+        settled += 1
+        if station in targets:
+            remaining -= 1
+            if not remaining:
+                break
+        for neighbour, (weight, _) in adjacency[station].items():
+            alt = time + weight
+            if neighbour != skip and alt <= limit and alt < dist.get(neighbour, MATRIX_UNREACHABLE):
+                dist[neighbour] = alt
+                heapq.heappush(heap, (alt, neighbour))
+    return dist
+
+
+def _shortcuts(adjacency, station):
+    # (src, dst, seconds) shortcuts contracting station needs: pairs of its neighbours whose
+    # shortest connection goes through it
+    neighbours = list(adjacency[station].items())
+    shortcuts = []
+    for i, (src, (weight, _)) in enumerate(neighbours):
+        targets = {dst: weight + other for dst, (other, _) in neighbours[i + 1:]}
+        if not targets:
+            continue
+        dist = _witness_search(adjacency, src, station, max(targets.values()), targets)
+        for dst, via in targets.items():
+            if dist.get(dst, MATRIX_UNREACHABLE) > via:
+                shortcuts.append((src, dst, via))
+    return shortcuts
+
+
+@_timed('contraction_hierarchy')
+def build_contraction_hierarchy(metro):
+    # contracts stations in edge difference order over rides and changes merged into one
+    # undirected graph, the faster kind wins when a pair has both and rides win ties like in Route
+    count = len(metro._ids)
+    adjacency = [{} for _ in range(count)]
+    for edges, kind in ((metro._rides, CONTRACTION_RIDE), (metro._transfers, CONTRACTION_CHANGE)):
+        for st1, st2, weight in zip(edges.src, edges.dst, edges.weight):
+            if st1 != st2 and weight < adjacency[st1].get(st2, (MATRIX_UNREACHABLE,))[0]:
+                adjacency[st1][st2] = adjacency[st2][st1] = (weight, kind)
+    contracted_neighbours = [0] * count
+
+    def priority(station):
+        shortcuts = _shortcuts(adjacency, station)
+        return len(shortcuts) - len(adjacency[station]) + contracted_neighbours[station], shortcuts
+
+    heap = [(priority(station)[0], station) for station in range(count)]
+    heapq.heapify(heap)
+    rank = array.array('I', [0]) * count
+    upward = [()] * count
+    for order in range(count):
+        while True:
+            # priorities go stale as neighbours are contracted, recheck before contracting
+            _, station = heapq.heappop(heap)
+            value, shortcuts = priority(station)
+            if not heap or value <= heap[0][0]:
+                break
+            heapq.heappush(heap, (value, station))
+        rank[station] = order
+        # every remaining neighbour is contracted later, so all edges left here go upward
+        upward[station] = sorted(adjacency[station].items())
+        for src, dst, via in shortcuts:
+            if via < adjacency[src].get(dst, (MATRIX_UNREACHABLE,))[0]:
+                adjacency[src][dst] = adjacency[dst][src] = (via, station)
+        for neighbour in adjacency[station]:
+            del adjacency[neighbour][station]
+            contracted_neighbours[neighbour] += 1
+        adjacency[station] = {}
+
+    offsets = array.array('I', [0])
+    targets = array.array('I')
+    weights = array.array('I')
+    middles = array.array('i')
+    for edges in upward:
+        for neighbour, (weight, middle) in edges:
+            targets.append(neighbour)
+            weights.append(weight)
+            middles.append(middle)
+        offsets.append(len(targets))
+    return ContractionHierarchy(metro._ids, rank, offsets, targets, weights, middles)
+
+
+class ContractionHierarchy(object):
+    # upward edges of every station in CSR form: towards higher ranked stations only, shortcuts
+    # remember the station they skip so routes can be unpacked into the original segments
+    def __init__(self, ids, rank, offsets, targets, weights, middles):
+        self.ids = list(ids)
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.rank = rank
+        self._offsets = offsets
+        self._targets = targets
+        self._weights = weights
+        self._middles = middles
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _Index(self, id):
+        try:
+            return self.index[id]
+        except KeyError:
+            raise UnknownStationError(id)
+
+    def _Middle(self, st1, st2):
+        low, high = (st1, st2) if self.rank[st1] < self.rank[st2] else (st2, st1)
+        for i in range(self._offsets[low], self._offsets[low + 1]):
+            if self._targets[i] == high:
+                return self._middles[i]
+        raise MetroError("No edge between '{}' and '{}'".format(self.ids[st1], self.ids[st2]))
+
+    def _Unpack(self, st1, st2, path, kinds):
+        stack = [(st1, st2)]
+        while stack:
+            st1, st2 = stack.pop()
+            middle = self._Middle(st1, st2)
+            if middle < 0:
+                path.append(st2)
+                kinds.append(middle == CONTRACTION_CHANGE)
+            else:
+                stack.append((middle, st2))
+                stack.append((st1, middle))
+
+    def Search(self, src, dst):
+        # bidirectional Dijkstra over upward edges from both ends, (seconds, path, kinds) over
+        # station indices like Metro._SearchPath or None if dst cant be reached
+        offsets, targets, weights = self._offsets, self._targets, self._weights
+        dists = ({src: 0}, {dst: 0})
+        parents = ({}, {})
+        heaps = ([(0, src)], [(0, dst)])
+        best = MATRIX_UNREACHABLE
+        meeting = None
+        while heaps[0] or heaps[1]:
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0] <= heaps[1][0]) else 1
+            heap = heaps[side]
+            time, station = heapq.heappop(heap)
+            if time >= best:
+                # nothing left on this side can improve the best meeting
+                del heap[:]
+                continue
+            dist = dists[side]
+            if time > dist[station]:
+                continue
+            other = dists[1 - side].get(station)
+            if other is not None and time + other < best:
+                best = time + other
+                meeting = station
+            parent = parents[side]
+            for i in range(offsets[station], offsets[station + 1]):
+                neighbour = targets[i]
+                alt = time + weights[i]
+                if alt < dist.get(neighbour, MATRIX_UNREACHABLE):
+                    dist[neighbour] = alt
+                    parent[neighbour] = station
+                    heapq.heappush(heap, (alt, neighbour))
+        if meeting is None:
+            return None
+        up = [meeting]
+        while up[-1] != src:
+            up.append(parents[0][up[-1]])
+        up.reverse()
+        down = [meeting]
+        while down[-1] != dst:
+            down.append(parents[1][down[-1]])
+        path = [src]
+        kinds = []
+        for hops in (up, down):
+            for st1, st2 in zip(hops, hops[1:]):
+                self._Unpack(st1, st2, path, kinds)
+        return best, path, kinds
+
+    def Route(self, src, dst):
+        # same MetroRoute as Metro.Route, stations may differ between equally fast routes
+        result = self.Search(self._Index(src), self._Index(dst))
+        return None if result is None else _make_route(self.ids, *result)
+
+
+def write_contraction_hierarchy(metro, path):
+    hierarchy = metro.ContractionHierarchy()
+    count = len(hierarchy)
+    sections = [array.array('I', hierarchy.rank), hierarchy._offsets, hierarchy._targets, hierarchy._weights,
+                hierarchy._middles]
+    if sys.byteorder != 'little':
+        sections = [array.array(section.typecode, section) for section in sections]
+        for section in sections:
+            section.byteswap()
+    writer = AtomicWriter(path, 'wb')
+    with writer as f:
+        f.write(CONTRACTION_HEADER.pack(CONTRACTION_MAGIC, CONTRACTION_VERSION, count, len(hierarchy._targets)))
+        size = CONTRACTION_HEADER.size + _write_ids(f, hierarchy.ids)
+        f.write(b'\0' * (-size % 4))
+        for section in sections:
+            section.tofile(f)
+    return writer.changed
+
+
+def load_contraction_hierarchy(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, count, edge_count = CONTRACTION_HEADER.unpack_from(data, 0)
+    if magic != CONTRACTION_MAGIC or version != CONTRACTION_VERSION:
+        raise MetroError("'{}' is not a version {} contraction hierarchy".format(path, CONTRACTION_VERSION))
+    ids, offset = _read_ids(data, CONTRACTION_HEADER.size, count)
+    offset += -offset % 4
+    sections = []
+    for typecode, size in (('I', count), ('I', count + 1), ('I', edge_count), ('I', edge_count), ('i', edge_count)):
+        section = array.array(typecode)
+        section.frombytes(data[offset:offset + size * 4])
+        if sys.byteorder != 'little':
+            section.byteswap()
+        sections.append(section)
+        offset += size * 4
+    return ContractionHierarchy(ids, *sections)
+
+
+class MetroError(Exception):
+    pass
+
+
+class UnknownStationError(MetroError, KeyError):
+    def __init__(self, id):
+        super(UnknownStationError, self).__init__(id)
+        self.id = id
+
+    def __str__(self):
+        return "Cant find station '{}'".format(self.id)
+
+
+class DuplicateStationError(MetroError, ValueError):
+    def __init__(self, id, line_id):
+        super(DuplicateStationError, self).__init__(id, line_id)
+        self.id = id
+        self.line_id = line_id
+
+    def __str__(self):
+        return "Station '{}' already exists on line '{}'".format(self.id, self.line_id)
+
+
+# time in seconds, station ids from source to destination, (from, to) pairs of every change
+MetroRoute = collections.namedtuple('MetroRoute', ['time', 'stations', 'transfers'])
+# requested departure and arrival in seconds since the start of the service day, stations and changes as above
+MetroJourney = collections.namedtuple('MetroJourney', ['departure', 'arrival', 'stations', 'transfers'])
+
+
+def _make_route(ids, time, path, kinds):
+    # MetroRoute of a path of station indices, kinds[i] tells whether path[i] -> path[i + 1] is a change
+    transfers = [(ids[st1], ids[st2]) for st1, st2, is_change in zip(path, path[1:], kinds) if is_change]
+    return MetroRoute(time, [ids[station] for station in path], transfers)
+
+
+def _walk_back(prev, src, dst):
+    # path and kinds from src to dst out of {station: (parent, is change)} predecessors
+    path = [dst]
+    kinds = []
+    while path[-1] != src:
+        parent, is_change = prev[path[-1]]
+        path.append(parent)
+        kinds.append(is_change)
+    path.reverse()
+    kinds.reverse()
+    return path, kinds
+
+
+def parse_clock(value):
+    # seconds, or "HH:MM[:SS]" since the start of the service day; hours may go past 24
+    if isinstance(value, str):
+        parts = [int(part) for part in value.split(':')]
+        if not 2 <= len(parts) <= 3:
+            raise MetroError("Bad clock time '{}'".format(value))
+        return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) == 3 else 0)
+    return int(value)
 
 
 class BasicObj(object):
+    __slots__ = ('id', 'name')
+    _json_fields = ('id', 'name')
+
     def __init__(self, id, name):
         self.id = id
         self.name = name
 
 
 class MetroStation(BasicObj):
+    __slots__ = ('x', 'y', 'lat', 'lon')
+    _json_fields = ('id', 'name', 'x', 'y', 'lat', 'lon')
+
     def __init__(self, id, name, x, y, lat, lon):
         self.id = id
         self.name = name
@@ -62,503 +867,1419 @@ class MetroStation(BasicObj):
 
 
 class MetroLine(BasicObj):
-    def __init__(self, id, name, color):
+    __slots__ = ('color', 'stations', '_metro')
+    _json_fields = ('id', 'name', 'color', 'stations')
+
+    def __init__(self, id, name, color, metro=None):
         self.id = id
         self.name = name
         self.color = color
-        self.stations = collections.OrderedDict()
+        self.stations = {}
+        self._metro = metro
 
     def AddStation(self, id, name, x, y, lat, lon):
-        self.stations[id] = MetroStation(id, name, x, y, lat, lon)
-        return self.stations[id]
+        station = MetroStation(id, name, x, y, lat, lon)
+        if self._metro is not None:
+            self._metro._RegisterStation(self, station)
+        elif id in self.stations:
+            raise DuplicateStationError(id, self.id)
+        self.stations[id] = station
+        return station
+
+    def AddStations(self, rows):
+        # bulk path for (id, name, x, y, lat, lon) rows
+        stations = [MetroStation(*row) for row in rows]
+        if self._metro is not None:
+            self._metro._RegisterStations(self, stations)
+        else:
+            seen = set(self.stations)
+            for station in stations:
+                if station.id in seen:
+                    raise DuplicateStationError(station.id, self.id)
+                seen.add(station.id)
+        self.stations.update((station.id, station) for station in stations)
+        return stations
+
+
+# queries further than this many meters outside the box around the stations skip the grid
+SPATIAL_INDEX_MARGIN = 20000.
+
+
+class SpatialIndex(object):
+    # uniform grid over an equirectangular projection (meters) centered on the stations;
+    # candidates are ranked with the exact distance(), far away queries scan every station
+    def __init__(self, ids, lats, lons, cell_size=None):
+        self.ids = list(ids)
+        self._lats = list(lats)
+        self._lons = list(lons)
+        count = len(self.ids)
+        self._lat0 = sum(self._lats) / count if count else 0.
+        self._lon0 = sum(self._lons) / count if count else 0.
+        self._scale = math.pi / 180. * 6372795
+        self._cos0 = math.cos(self._lat0 * math.pi / 180.)
+        points = [self._Project(lat, lon) for lat, lon in zip(self._lats, self._lons)]
+        if cell_size is None:
+            if count > 1:
+                width = max(x for x, _ in points) - min(x for x, _ in points)
+                height = max(y for _, y in points) - min(y for _, y in points)
+                # about two stations per cell on average
+                cell_size = math.sqrt(max(width * height, 1.) * 2 / count)
+            cell_size = max(cell_size or 0, 100.)
+        self.cell_size = cell_size
+        self._cells = collections.defaultdict(list)
+        for i, (x, y) in enumerate(points):
+            self._cells[self._Cell(x, y)].append(i)
+        cells = list(self._cells) or [(0, 0)]
+        self._bounds = (min(cx for cx, _ in cells), min(cy for _, cy in cells),
+                        max(cx for cx, _ in cells), max(cy for _, cy in cells))
+        margin = int(math.ceil(SPATIAL_INDEX_MARGIN / cell_size))
+        self._reach = (self._bounds[0] - margin, self._bounds[1] - margin,
+                       self._bounds[2] + margin, self._bounds[3] + margin)
+        # the projection stretches east-west distances away from lat0; within the reach of the grid
+        # a projected distance times _slack is never more than the distance() between the points
+        furthest = max((abs(lat) for lat in self._lats), default=0.) + \
+            (SPATIAL_INDEX_MARGIN + 2 * cell_size) / self._scale
+        self._slack = 0.99 * min(1., math.cos(min(furthest, 90.) * math.pi / 180.) / self._cos0) \
+            if self._cos0 > 0 else 0.
+        if numpy is not None:
+            self._coordinates = (numpy.array(self._lats, dtype=numpy.float64),
+                                 numpy.array(self._lons, dtype=numpy.float64))
+        else:
+            self._coordinates = (self._lats, self._lons)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _Project(self, lat, lon):
+        return (lon - self._lon0) * self._cos0 * self._scale, (lat - self._lat0) * self._scale
+
+    def _Cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _Point(self, lat, lon):
+        # projected query point, None if it is outside the reach of the grid
+        if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90):
+            raise MetroError('Bad coordinates ({}, {})'.format(lat, lon))
+        # longitudes differing by whole turns are the same meridian
+        x, y = self._Project(lat, (lon - self._lon0 + 180.) % 360. - 180. + self._lon0)
+        cx, cy = self._Cell(x, y)
+        minx, miny, maxx, maxy = self._reach
+        if self._slack <= 0 or not (minx <= cx <= maxx and miny <= cy <= maxy):
+            return None
+        return x, y
+
+    def _Scan(self, lat, lon):
+        # (meters, station) for every station
+        return [(float(dist), i) for i, dist in enumerate(distances(lat, lon, *self._coordinates))]
+
+    def _Ring(self, cx, cy, radius):
+        # cells at Chebyshev distance radius from (cx, cy) that lie within the bounds of the stations
+        minx, miny, maxx, maxy = self._bounds
+        if radius == 0:
+            yield cx, cy
+            return
+        xs = range(max(cx - radius, minx), min(cx + radius, maxx) + 1)
+        for y in (cy - radius, cy + radius):
+            if miny <= y <= maxy:
+                for x in xs:
+                    yield x, y
+        for x in (cx - radius, cx + radius):
+            if minx <= x <= maxx:
+                for y in range(max(cy - radius + 1, miny), min(cy + radius - 1, maxy) + 1):
+                    yield x, y
+
+    def _MaxRing(self, cx, cy):
+        minx, miny, maxx, maxy = self._bounds
+        return max(abs(cx - minx), abs(cx - maxx), abs(cy - miny), abs(cy - maxy))
+
+    def Nearest(self, lat, lon, k=1):
+        # k closest stations as (id, meters), closest first
+        point = self._Point(lat, lon)
+        if k <= 0 or not self.ids:
+            return []
+        if point is None:
+            return [(self.ids[i], dist) for dist, i in heapq.nsmallest(k, self._Scan(lat, lon))]
+        cx, cy = self._Cell(*point)
+        best = []
+        for radius in range(self._MaxRing(cx, cy) + 1):
+            # stations in this and further rings are at least radius - 1 cells away
+            if len(best) >= k and -best[0][0] <= (radius - 1) * self.cell_size * self._slack:
+                break
+            for cell in self._Ring(cx, cy, radius):
+                for i in self._cells.get(cell, ()):
+                    dist = distance(lat, lon, self._lats[i], self._lons[i])
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist, -i))
+                    elif dist < -best[0][0]:
+                        heapq.heapreplace(best, (-dist, -i))
+        return [(self.ids[-i], -dist) for dist, i in sorted(best, reverse=True)]
+
+    def Within(self, lat, lon, radius_m):
+        # every station not further than radius_m meters as (id, meters), closest first
+        point = self._Point(lat, lon)
+        if not radius_m >= 0:
+            raise MetroError('Bad radius {}'.format(radius_m))
+        # 1% slack for the difference between the projection and distance(), more far from lat0
+        reach = radius_m / self._slack if point is not None else float('inf')
+        if reach > SPATIAL_INDEX_MARGIN:
+            found = [(dist, i) for dist, i in self._Scan(lat, lon) if dist <= radius_m]
+        else:
+            x, y = point
+            minx, miny = self._Cell(x - reach, y - reach)
+            maxx, maxy = self._Cell(x + reach, y + reach)
+            found = []
+            for cx in range(max(minx, self._bounds[0]), min(maxx, self._bounds[2]) + 1):
+                for cy in range(max(miny, self._bounds[1]), min(maxy, self._bounds[3]) + 1):
+                    for i in self._cells.get((cx, cy), ()):
+                        dist = distance(lat, lon, self._lats[i], self._lons[i])
+                        if dist <= radius_m:
+                            found.append((dist, i))
+        found.sort()
+        return [(self.ids[i], dist) for dist, i in found]
+
+
+SEARCH_VERSION = 1
+# match kinds, best first; keys of a search index are the whole name or id, or one of its later words
+SEARCH_KINDS = ('exact', 'prefix', 'word', 'fuzzy')
+SEARCH_EXACT, SEARCH_PREFIX, SEARCH_WORD, SEARCH_FUZZY = range(len(SEARCH_KINDS))
+# best stations kept per trie node, the most a prefix query returns
+SEARCH_NODE_LIMIT = 50
+# distinct keys sharing the most trigrams with a query that get their edit distance computed
+SEARCH_FUZZY_CANDIDATES = 64
+
+# city id, station id and name, match kind and edit distance of the query from the matched key
+StationMatch = collections.namedtuple('StationMatch', ['city', 'id', 'name', 'kind', 'distance'])
+
+
+def normalize_name(text):
+    # case and ё/е insensitive words of letters and digits, separated by single spaces
+    return ' '.join(word for word in re.split(r'[\W_]+', text.casefold().replace('ё', 'е')) if word)
+
+
+def search_keys(ids, names):
+    # (key, station index, SEARCH_PREFIX or SEARCH_WORD) for the names and ids of stations
+    keys = []
+    for station, (id, name) in enumerate(zip(ids, names)):
+        seen = set()
+        for text in (name, id):
+            text = normalize_name(text)
+            starts = [0] + [i + 1 for i, char in enumerate(text) if char == ' ']
+            for start in starts:
+                if text and text[start:] not in seen:
+                    seen.add(text[start:])
+                    keys.append((text[start:], station, SEARCH_WORD if start else SEARCH_PREFIX))
+    return keys
+
+
+def _trigrams(text):
+    text = ' ' + text
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _prefix_distance(query, key, limit):
+    # edit distance from query to the closest prefix of key, None if it is above limit; only
+    # the band of cells within limit of the diagonal is computed
+    key = key[:len(query) + limit]
+    big = limit + 1
+    row = [min(j, big) for j in range(len(key) + 1)]
+    for i, char in enumerate(query, 1):
+        previous = row
+        row = [min(i, big)] + [big] * len(key)
+        for j in range(max(1, i - limit), min(len(key), i + limit) + 1):
+            row[j] = min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + (char != key[j - 1]), big)
+        if min(row) > limit:
+            return None
+    return min(row)
+
+
+class StationSearch(object):
+    # autocomplete over station names and ids: a trie of normalized keys whose nodes keep their best
+    # stations, and trigram postings for queries with typos
+    def __init__(self, city, ids, names, keys):
+        self.city = city
+        self.ids = list(ids)
+        self.names = list(names)
+        self.keys = keys
+        self._exact = collections.defaultdict(set)
+        # key -> stations and trigram -> keys, stations sharing a name share their fuzzy matching work
+        self._stations = collections.defaultdict(list)
+        self._trigrams = collections.defaultdict(list)
+        self._root = {}
+        for key, station, kind in keys:
+            if kind == SEARCH_PREFIX:
+                self._exact[key].add(station)
+            if key not in self._stations:
+                for trigram in _trigrams(key):
+                    self._trigrams[trigram].append(key)
+            self._stations[key].append(station)
+            entry = (kind, len(self.names[station]), self.names[station], station)
+            node = self._root
+            for char in key:
+                node = node.setdefault(char, {'': []})
+                node[''].append(entry)
+        # every node keeps its best SEARCH_NODE_LIMIT stations, a station once with its best kind
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            if '' in node:
+                seen = set()
+                entries = []
+                for kind, _, _, station in sorted(node['']):
+                    if station not in seen and len(entries) < SEARCH_NODE_LIMIT:
+                        seen.add(station)
+                        entries.append((kind, station))
+                node[''] = entries
+            nodes.extend(child for char, child in node.items() if char)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _Rank(self, station, kind, distance):
+        return kind, distance, len(self.names[station]), self.names[station], self.city or ''
+
+    def Search(self, query, limit=10):
+        # StationMatches best first: the whole name or id, a prefix of it, a prefix of one of its
+        # later words, then keys with a prefix a few edits away from the query
+        text = normalize_name(query)
+        if not text or limit <= 0:
+            return []
+        found = {station: (SEARCH_EXACT, 0) for station in self._exact.get(text, ())}
+        node = self._root
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            for kind, station in node['']:
+                found.setdefault(station, (kind, 0))
+        if len(found) < limit and len(text) >= 3:
+            trigrams = _trigrams(text)
+            counts = collections.Counter()
+            for trigram in trigrams:
+                counts.update(self._trigrams.get(trigram, ()))
+            allowed = max(1, (len(text) + 1) // 5)
+            # one edit changes at most three trigrams of the query
+            needed = len(trigrams) - 3 * allowed
+            for key, count in counts.most_common(SEARCH_FUZZY_CANDIDATES):
+                if count < needed:
+                    break
+                stations = [station for station in self._stations[key]
+                            if found.get(station, (SEARCH_FUZZY,))[0] == SEARCH_FUZZY]
+                if not stations:
+                    continue
+                distance = _prefix_distance(text, key, allowed)
+                if distance is None:
+                    continue
+                for station in stations:
+                    if (SEARCH_FUZZY, distance) < found.get(station, (len(SEARCH_KINDS), 0)):
+                        found[station] = (SEARCH_FUZZY, distance)
+        ranked = sorted(found.items(), key=lambda item: self._Rank(item[0], *item[1]))
+        return [StationMatch(self.city, self.ids[station], self.names[station], SEARCH_KINDS[kind], distance)
+                for station, (kind, distance) in ranked[:limit]]
+
+
+def search_stations(indexes, query, limit=10):
+    # StationMatches of every StationSearch in indexes, ranked together
+    matches = [match for index in indexes for match in index.Search(query, limit)]
+    matches.sort(key=lambda match: (SEARCH_KINDS.index(match.kind), match.distance, len(match.name), match.name,
+                                    match.city or ''))
+    return matches[:limit]
+
+
+def write_search_index(metro, path):
+    # the normalized keys, enough to rebuild the trie and trigram postings without normalizing again
+    index = metro.SearchIndex()
+    writer = AtomicWriter(path, encoding='utf-8')
+    with writer as f:
+        json.dump({'version': SEARCH_VERSION, 'city': index.city, 'stations': list(zip(index.ids, index.names)),
+                   'keys': index.keys}, f, ensure_ascii=False, separators=(',', ':'))
+    return writer.changed
+
+
+def load_search_index(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != SEARCH_VERSION:
+        raise MetroError("'{}' is not a version {} search index".format(path, SEARCH_VERSION))
+    ids = [id for id, _ in data['stations']]
+    names = [name for _, name in data['stations']]
+    return StationSearch(data['city'], ids, names, [tuple(key) for key in data['keys']])
+
+
+class _EdgeSet(object):
+    # undirected weighted edges between dense station indices, in insertion order
+    __slots__ = ('src', 'dst', 'weight', '_slots', '_csr')
+
+    def __init__(self):
+        self.src = array.array('I')
+        self.dst = array.array('I')
+        self.weight = array.array('I')
+        self._slots = {}
+        self._csr = None
+
+    def __len__(self):
+        return len(self.src)
+
+    def _Key(self, st1, st2):
+        return (st1 << 32) | st2 if st1 < st2 else (st2 << 32) | st1
+
+    def Set(self, st1, st2, weight):
+        key = self._Key(st1, st2)
+        slot = self._slots.get(key)
+        if slot is None:
+            self._slots[key] = len(self.src)
+            self.src.append(st1)
+            self.dst.append(st2)
+            self.weight.append(weight)
+        else:
+            self.weight[slot] = weight
+        self._csr = None
+
+    def Get(self, st1, st2):
+        slot = self._slots.get(self._Key(st1, st2))
+        return None if slot is None else self.weight[slot]
+
+    def Csr(self, count):
+        # offsets, neighbours and weights with both directions of every edge
+        if self._csr is None or len(self._csr[0]) != count + 1:
+            degree = [0] * (count + 1)
+            for st1, st2 in zip(self.src, self.dst):
+                degree[st1 + 1] += 1
+                degree[st2 + 1] += 1
+            for i in range(count):
+                degree[i + 1] += degree[i]
+            offsets = array.array('I', degree)
+            fill = degree[:-1]
+            neighbours = array.array('I', [0]) * degree[-1]
+            weights = array.array('I', [0]) * degree[-1]
+            for st1, st2, weight in zip(self.src, self.dst, self.weight):
+                neighbours[fill[st1]] = st2
+                weights[fill[st1]] = weight
+                fill[st1] += 1
+                neighbours[fill[st2]] = st1
+                weights[fill[st2]] = weight
+                fill[st2] += 1
+            self._csr = (offsets, neighbours, weights)
+        return self._csr
+
+
+class _EdgeView(collections.abc.Mapping):
+    # read-only "st1@st2" -> seconds view of an _EdgeSet, the shape of the exported JSON
+    __slots__ = ('_metro', '_edges')
+
+    def __init__(self, metro, edges):
+        self._metro = metro
+        self._edges = edges
+
+    def __getitem__(self, key):
+        st1, _, st2 = key.partition('@')
+        index = self._metro._index
+        if st1 not in index or st2 not in index:
+            raise KeyError(key)
+        weight = self._edges.Get(index[st1], index[st2])
+        if weight is None:
+            raise KeyError(key)
+        return weight
+
+    def __iter__(self):
+        ids = self._metro._ids
+        for st1, st2 in zip(self._edges.src, self._edges.dst):
+            yield "{}@{}".format(ids[st1], ids[st2])
+            if st1 != st2:
+                yield "{}@{}".format(ids[st2], ids[st1])
+
+    def items(self):
+        ids = self._metro._ids
+        for st1, st2, weight in zip(self._edges.src, self._edges.dst, self._edges.weight):
+            yield "{}@{}".format(ids[st1], ids[st2]), weight
+            if st1 != st2:
+                yield "{}@{}".format(ids[st2], ids[st1]), weight
+
+    def __len__(self):
+        return sum(2 if st1 != st2 else 1 for st1, st2 in zip(self._edges.src, self._edges.dst))
 
 
 class Metro(BasicObj):
+    __slots__ = ('accusative_name', 'lines', 'station_count', '_index', '_ids', '_nodes', '_node_lines',
+                 '_rides', '_transfers', '_coordinates', '_spatial_index', '_headways', '_station_closures',
+                 '_segment_closures', '_revision', '_hierarchy', '_search_index')
+    _json_fields = ('id', 'name', 'accusative_name', 'lines', 'times', 'changes', 'station_count')
+
     def __init__(self, id, name, accusative_name):
         self.id = id
         self.name = name
         self.accusative_name = accusative_name
-        self.lines = collections.OrderedDict()
-        self.times = {}
-        self.changes = {}
+        self.lines = {}
         self.station_count = 0
+        # dense station indices: id -> index, index -> id/MetroStation/MetroLine
+        self._index = {}
+        self._ids = []
+        self._nodes = []
+        self._node_lines = []
+        self._rides = _EdgeSet()
+        self._transfers = _EdgeSet()
+        # station latitudes and longitudes for StationDistances, rebuilt when stations are added
+        self._coordinates = None
+        self._spatial_index = None
+        self._search_index = None
+        # line id -> sorted [(start, end, headway)], station index -> [(start, end)] closed windows and
+        # edge key -> [(start, end)] closed windows, used by EarliestArrival only
+        self._headways = {}
+        self._station_closures = {}
+        self._segment_closures = {}
+        # bumped by every change of the network, see RouteCache
+        self._revision = 0
+        # (revision, ContractionHierarchy) built by ContractionHierarchy()
+        self._hierarchy = None
+
+    @property
+    def revision(self):
+        return self._revision
+
+    @property
+    def times(self):
+        return _EdgeView(self, self._rides)
+
+    @property
+    def changes(self):
+        return _EdgeView(self, self._transfers)
+
+    def _RegisterStation(self, line, station):
+        self._RegisterStations(line, [station])
+
+    def _RegisterStations(self, line, stations):
+        index = {}
+        for station in stations:
+            if station.id in self._index:
+                raise DuplicateStationError(station.id, self._node_lines[self._index[station.id]].id)
+            if station.id in index:
+                raise DuplicateStationError(station.id, line.id)
+            index[station.id] = len(self._ids) + len(index)
+        self._index.update(index)
+        self._ids.extend(station.id for station in stations)
+        self._nodes.extend(stations)
+        self._node_lines.extend([line] * len(stations))
+        self._revision += 1
+        if _instrumentation is not None:
+            _instrumentation.Count('stations_added', len(stations))
 
     def __SearchStation(self, id):
-        for line_id in self.lines:
-            line = self.lines[line_id]
-            for station_id in line.stations:
-                if station_id == id:
-                    return line.stations[station_id]
-        print("Cant find station '{}'. Halt.".format(id))
-        return False
+        if _instrumentation is not None:
+            _instrumentation.Count('lookups')
+        try:
+            return self._index[id]
+        except KeyError:
+            raise UnknownStationError(id)
+
+    def GetStation(self, id):
+        return self._nodes[self.__SearchStation(id)]
 
+    def GetStationLine(self, id):
+        return self._node_lines[self.__SearchStation(id)]
+
+    def HasStation(self, id):
+        return id in self._index
+
+    @_timed('fill_default_times')
     def FillDefaultTimes(self, metrospeed=41):
         for line_id in self.lines:
             line = self.lines[line_id]
             self.station_count += len(line.stations)
-            tmp = line.stations.copy()
-            st1 = tmp.popitem()
-            while len(tmp):
-                st2 = tmp.popitem()
-                self.AddTime(st1[1].id, st2[1].id, metrospeed)
-                st1 = st2
+            # segments from the last station back to the first, all distances of the line in one call
+            stations = list(reversed(line.stations.values()))
+            if len(stations) < 2:
+                continue
+            dists = distances([station.lat for station in stations[:-1]], [station.lon for station in stations[:-1]],
+                              [station.lat for station in stations[1:]], [station.lon for station in stations[1:]])
+            for st1, st2, dist in zip(stations, stations[1:], list(dists)):
+                self._rides.Set(self._index[st1.id], self._index[st2.id], travel_time(float(dist), metrospeed))
+            if _instrumentation is not None:
+                _instrumentation.Count('edges_computed', len(stations) - 1)
+        self._revision += 1
 
     def AddLine(self, id, name, color):
-        self.lines[id] = MetroLine(id, name, color)
+        self.lines[id] = MetroLine(id, name, color, self)
         return self.lines[id]
 
+    @_timed('add_time')
     def AddTime(self, st1, st2, metrospeed=41):
         st1 = self.__SearchStation(st1)
         st2 = self.__SearchStation(st2)
-        time = int(round(distance(st1.lat, st1.lon, st2.lat, st2.lon) / (metrospeed * 1000) * 60 * 60 / 10) * 10)
-        self.times["{}@{}".format(st1.id, st2.id)] = time
-        self.times["{}@{}".format(st2.id, st1.id)] = time
+        station1 = self._nodes[st1]
+        station2 = self._nodes[st2]
+        time = travel_time(distance(station1.lat, station1.lon, station2.lat, station2.lon), metrospeed)
+        self._rides.Set(st1, st2, time)
+        self._revision += 1
+        if _instrumentation is not None:
+            _instrumentation.Count('edges_computed')
 
+    @_timed('add_change')
     def AddChange(self, st1, st2, time=180):
         st1 = self.__SearchStation(st1)
         st2 = self.__SearchStation(st2)
-        self.changes["{}@{}".format(st1.id, st2.id)] = time
-        self.changes["{}@{}".format(st2.id, st1.id)] = time
-
-samara = Metro('samara', 'Самара', 'Самары')
-line = samara.AddLine('pervaya_liniya', 'Первая линия', "ed1c24")
-line.AddStation("rossiiskaya", "Российская", 8, 7, 53.2118766980059, 50.1486386614009)
-line.AddStation("moskovskaya", "Московская", 8, 29, 53.202790718652, 50.1600313758649)
-line.AddStation("gagarinskaya", "Гагаринская", 8, 52, 53.200161337646, 50.177529740611)
-line.AddStation("sportivnaya", "Спортивная", 8, 75, 53.2008134491243, 50.2000559364409)
-line.AddStation("sovetskaya", "Советская", 8, 97, 53.201480283487, 50.2221422298796)
-line.AddStation("pobeda", "Победа", 8, 120, 53.2064477372389, 50.2340666349211)
-line.AddStation("bezimyanka", "Безымянка", 26, 142, 53.2125790564215, 50.2474971586028)
-line.AddStation("kirovskaya", "Кировская", 26, 164, 53.2108054795459, 50.2705860183973)
-line.AddStation("ungorodok", "Юнгородок", 26, 188, 53.2122381393962, 50.2818923630551)
-samara.FillDefaultTimes()
-print("Samara, {} stations".format(samara.station_count))
-
-novosib = Metro('novosibirsk', 'Новосибирск', 'Новосибирска')
-line1 = novosib.AddLine('leninskaya_liniya', 'Ленинская линия', 'ed1c24')
-line1.AddStation("zaelcovskaya", "Заельцовская", 139, 5, 55.0594091622915, 82.9125204381385)
-line1.AddStation("gagarinskaya", "Гагаринская", 139, 29, 55.051226323532, 82.9147689422392)
-line1.AddStation("krasnii_prospekt", "Красный Проспект", 139, 55, 55.0411052276485, 82.9174688526098)
-line1.AddStation("ploshad_lenina", "Площадь Ленина", 158, 73, 55.0301250810717, 82.9204697589818)
-line1.AddStation("oktyabrskaya", "Октябрьская", 173, 89, 55.0188557871026, 82.9391369750285)
-line1.AddStation("rechnoi_vokzal", "Речной Вокзал", 173, 113, 55.008793196091, 82.9383837271621)
-line1.AddStation("stydencheskaya", "Студенческая", 158, 128, 54.9892694136023, 82.9066422033525)
-line1.AddStation("ploshad_marksa", "Площадь Маркса", 139, 144, 54.9830484136531, 82.8932359733294)
-line2 = novosib.AddLine('dzerzhinskaya_liniya', 'Дзержинская линия', '009854')
-line2.AddStation("ploshad_garina-mihailovskogo", "Площадь Гарина-Михайловского", 108, 86, 55.0354295741637, 82.898965086287)
-line2.AddStation("sibirskaya", "Сибирская", 127, 66, 55.0422949381159, 82.9190003344673)
-line2.AddStation("marshala_pokrishkina", "Маршала Покрышкина", 171, 54, 55.0437475829323, 82.9355341205781)
-line2.AddStation("berezovaya_rosha", "Березовая Роща", 196, 54, 55.0432446458796, 82.9533895291642)
-line2.AddStation("zolotaya_niva", "Золотая Нива", 221, 54, 55.03714, 82.976991)
-novosib.AddChange('krasnii_prospekt', 'sibirskaya', 180)
-novosib.FillDefaultTimes()
-print("Novosib, {} stations".format(novosib.station_count))
-
-kazan = Metro('kazan', 'Казань', 'Казани')
-line = kazan.AddLine('centralnaya_liniya', 'Центральная линия', '009854')
-line.AddStation("kozya_sloboda", "Козья Слобода", 7, 8, 55.8176094498771, 49.0976540733133)
-line.AddStation("kremlevskaya", "Кремлевская", 7, 29, 55.7951938070189, 49.1073671253623)
-line.AddStation("ploshad_tykaya", "Площадь Тукая", 7, 53, 55.7871438715778, 49.1220820946131)
-line.AddStation("sykonnaya_cloboda", "Суконная Cлобода", 25, 74, 55.7763308530671, 49.1437398340866)
-line.AddStation("ametevo", "Аметьево", 25, 96, 55.7651798821464, 49.1664816922534)
-line.AddStation("gorki", "Горки", 25, 120, 55.7602495334154, 49.1903547256175)
-line.AddStation("prospekt_pobedi", "Проспект Победы", 25, 141, 55.7499520906488, 49.2085103667662)
-kazan.FillDefaultTimes()
-print("Kazan, {} stations".format(kazan.station_count))
-
-eburg = Metro('eburg', 'Екатеринбург', 'Екатеринбурга')
-line = eburg.AddLine('uralskaya_liniya', 'Уральская линия', '009854')
-line.AddStation("prospekt_kosmonavtov", "Проспект космонавтов", 44, 8, 56.9024616368319, 60.6134261894226)
-line.AddStation("yralmash", "Уралмаш", 44, 33, 56.888682263425, 60.6138774571644)
-line.AddStation("mashinostroitelei", "Машиностроителей", 44, 59, 56.8775244683109, 60.6118192056905)
-line.AddStation("yralskaya", "Уральская", 8, 95, 56.8580257019274, 60.600102521242)
-line.AddStation("dinamo", "Динамо", 8, 117, 56.8478902106605, 60.5994760666923)
-line.AddStation("ploshad_1905_goda", "Площадь 1905 года", 8, 140, 56.8362942109837, 60.5997617459885)
-line.AddStation("geologicheskaya", "Геологическая", 8, 163, 56.82744226647, 60.603072576321)
-line.AddStation("botanicheskaya", "Ботаническая", 8, 186, 56.797778, 60.630833)
-eburg.FillDefaultTimes(43)
-print("Eburg, {} stations".format(eburg.station_count))
-
-nn = Metro('nn', 'Нижний Новгород', 'Нижнего Новогорода')
-line1 = nn.AddLine('avtozavodskaya_liniya', 'Автозаводская линия', 'ed1c24')
-line1.AddStation("gorkovskaya", "Горьковская", 157, 31, 56.313889, 43.995)
-line1.AddStation("moskovskaya_kr", "Московская (Красная)", 157, 84, 56.3213240515983, 43.9455284486623)
-line1.AddStation("chkalovskaya", "Чкаловская", 157, 112, 56.3124761994768, 43.9371058153095)
-line1.AddStation("leninskaya", "Ленинская", 157, 137, 56.2977987400589, 43.937914715027)
-line1.AddStation("zarechnaya", "Заречная", 157, 162, 56.2851112671261, 43.9270312139491)
-line1.AddStation("dvigatel_revolucii", "Двигатель Революции", 157, 189, 56.276490975699, 43.9203733595221)
-line1.AddStation("proletarskaya", "Пролетарская", 157, 216, 56.266150483714, 43.9120550675397)
-line1.AddStation("avtozavodskaya", "Автозаводская", 157, 244, 56.2579069316524, 43.9025912143989)
-line1.AddStation("komsomolskaya", "Комсомольская", 136, 265, 56.2526413933239, 43.8910191643904)
-line1.AddStation("kirovskaya", "Кировская", 115, 286, 56.2480548868575, 43.8785797130432)
-line1.AddStation("park_kyltyri", "Парк Культуры", 94, 307, 56.2420431826785, 43.8579759272493)
-line2 = nn.AddLine('sormovskaya_liniya', 'Сормовская линия', '009854')
-line2.AddStation("byrevestnik", "Буревестник", 30, 107, 56.333299270711, 43.8966852693099)
-line2.AddStation("byrnakovskaya", "Бурнаковская", 68, 107, 56.3255896320251, 43.9131787704174)
-line2.AddStation("kanavinskaya", "Канавинская", 108, 107, 56.3203357436521, 43.9277911365766)
-line2.AddStation("moskovskaya_zel", "Московская (Зеленая)", 157, 61, 56.3213240515983, 43.9455284486623)
-nn.AddChange('moskovskaya_kr', 'moskovskaya_zel', 100)
-nn.FillDefaultTimes(43)
-print("NN, {} stations".format(nn.station_count))
-
-piter = Metro("piter", "Санкт-Петербург", 'Санкт-Петербурга')
-line = piter.AddLine('kirov', 'Кировско-Выборгская линия', 'ed1c24')
-line.AddStation("devyatkino", "Девяткино", 381, 8, 60.0504180568076, 30.4426482418862)
-line.AddStation("grajdanskii_prospekt", "Гражданский Проспект", 381, 36, 60.0349932339094, 30.4182351330508)
-line.AddStation("akademicheskaya", "Академическая", 381, 64, 60.0127881265531, 30.3959963490528)
-line.AddStation("politehnicheskaya", "Политехническая", 381, 93, 60.0089307437261, 30.3708935032768)
-line.AddStation("ploshad_myjestva", "Площадь Мужества", 381, 122, 60.0000469062996, 30.3661435100916)
-line.AddStation("lesnaya", "Лесная", 381, 149, 59.9847995941546, 30.3442441560376)
-line.AddStation("viborgskaya", "Выборгская", 381, 180, 59.97107418397, 30.3473159496264)
-line.AddStation("ploshad_lenina", "Площадь Ленина", 381, 211, 59.9587257590329, 30.355063995034)
-line.AddStation("chernishevskaya", "Чернышевская", 381, 245, 59.9445719014503, 30.3598681075581)
-line.AddStation("ploshad_vosstaniya", "Площадь Восстания", 381, 295, 59.9315704824326, 30.3606049263834)
-line.AddStation("vladimirskaya", "Владимирская", 317, 383, 59.9275343978482, 30.3479808584615)
-line.AddStation("pyshkinskaya", "Пушкинская", 302, 492, 59.9206848642178, 30.3296434981144)
-line.AddStation("tehnologicheskii_instityt_kvl", "Технологический Институт (Красная)", 218, 493, 59.9166016788181, 30.3186305982738)
-line.AddStation("baltiiskaya", "Балтийская", 75, 572, 59.9072580709679, 30.2996015594246)
-line.AddStation("narvskaya", "Нарвская", 75, 600, 59.9011809354463, 30.2748827438217)
-line.AddStation("kirovskii_zavod", "Кировский Завод", 75, 628, 59.8797733555588, 30.2620595696605)
-line.AddStation("avtovo", "Автово", 75, 656, 59.8672788214587, 30.2614345671433)
-line.AddStation("leninskii_prospekt", "Ленинский Проспект", 75, 686, 59.8516788869126, 30.2695808723803)
-line.AddStation("prospekt_veteranov", "Проспект Ветеранов", 75, 713, 59.8422227734773, 30.2500032516966)
-line = piter.AddLine('nevsk', 'Невско-Василеостровская линия', '009854')
-line.AddStation("primorskaya", "Приморская", 21, 296, 59.9484752058613, 30.2345274705924)
-line.AddStation("vasileostrovskaya", "Василеостровская", 41, 317, 59.9426167522675, 30.278239699514)
-line.AddStation("gostinii_dvor", "Гостиный Двор", 218, 317, 59.9339491454113, 30.3337259470064)
-line.AddStation("mayakovskaya", "Маяковская", 381, 317, 59.931561315709, 30.3549957974087)
-line.AddStation("ploshad_aleksandra_nevskogo_nevsk", "Площадь Александра Невского (Зеленая)", 508, 397, 59.9243416529627, 30.3852983081924)
-line.AddStation("elizarovskaya", "Елизаровская", 563, 487, 59.8968167794162, 30.4236569405928)
-line.AddStation("lomonosovskaya", "Ломоносовская", 563, 515, 59.8773304813072, 30.4417232344821)
-line.AddStation("proletarskaya", "Пролетарская", 563, 545, 59.8651930135168, 30.4702524533918)
-line.AddStation("obyhovo", "Обухово", 563, 572, 59.8487292712688, 30.4576875846492)
-line.AddStation("ribackoe", "Рыбацкое", 563, 603, 59.830908857392, 30.5003616565431)
-line = piter.AddLine('mosk', 'Московско-Петроградская линия', '009ddd')
-line.AddStation("parnas", "Парнас", 217, 42, 60.0670232650606, 30.3340196112187)
-line.AddStation("prospekt_prosvesheniya", "Проспект Просвещения", 217, 70, 60.0514455797832, 30.3324767465782)
-line.AddStation("ozerki", "Озерки", 217, 98, 60.0372656165281, 30.3215674601989)
-line.AddStation("ydelnaya", "Удельная", 217, 126, 60.0167022808087, 30.3156869293279)
-line.AddStation("pionerskaya", "Пионерская", 217, 156, 60.0025163655407, 30.2965246755954)
-line.AddStation("chernaya_rechka", "Черная Речка", 217, 183, 59.9854524583016, 30.3008006357264)
-line.AddStation("petrogradskaya", "Петроградская", 217, 213, 59.9664767135179, 30.3113497958292)
-line.AddStation("gorkovskaya", "Горьковская", 217, 245, 59.9561900629784, 30.3189073644837)
-line.AddStation("nevskii_prospekt", "Невский Проспект", 217, 295, 59.9355332422045, 30.3269963086294)
-line.AddStation("sennaya_ploshad", "Сенная Площадь", 217, 415, 59.9270433202057, 30.3204448399332)
-line.AddStation("tehnologicheskii_instityt_mosk", "Технологический Институт (Синяя)", 217, 516, 59.9166016788181, 30.3186305982738)
-line.AddStation("frynzenskaya", "Фрунзенская", 217, 572, 59.906319642133, 30.3174935700306)
-line.AddStation("moskovskie_vorota", "Московские Ворота", 217, 600, 59.8917902318199, 30.3176102163092)
-line.AddStation("elektrosila", "Электросила", 217, 628, 59.8792808010769, 30.3186513405386)
-line.AddStation("park_pobedi", "Парк Победы", 217, 657, 59.866344974198, 30.3219209249361)
-line.AddStation("moskovskaya", "Московская", 217, 686, 59.8494055803501, 30.3220888480257)
-line.AddStation("zvyozdnaya", "Звёздная", 217, 713, 59.8332655783742, 30.3494755745893)
-line.AddStation("kypchino", "Купчино", 217, 744, 59.8295129551429, 30.3755091810098)
-line = piter.AddLine('prav', 'Правобережная линия', 'fbaa34')
-line.AddStation("spasskaya", "Спасская", 229, 397, 59.9269996463036, 30.3203008931054)
-line.AddStation("dostoevskaya", "Достоевская", 302, 397, 59.9283354981234, 30.3460606789687)
-line.AddStation("ligovskii_prospekt", "Лиговский Проспект", 381, 397, 59.9208282373637, 30.354986201418)
-line.AddStation("ploshad_aleksandra_nevskogo_prav", "Площадь Александра Невского (Желтая)", 486, 397, 59.9236214294491, 30.3834814339649)
-line.AddStation("novocherkasskaya", "Новочеркасская", 635, 488, 59.928983338843, 30.4118859995645)
-line.AddStation("ladojskaya", "Ладожская", 635, 515, 59.9325178542861, 30.4393841377987)
-line.AddStation("prospekt_bolshevikov", "Проспект Большевиков", 635, 544, 59.9199509754615, 30.4668255493613)
-line.AddStation("ylica_dibenko", "Улица Дыбенко", 635, 572, 59.9074689860044, 30.4833384194591)
-line = piter.AddLine('frun', 'Фрунзенско-Приморская линия', 'b41e8e')
-line.AddStation("komendantskii_prospekt", "Комендантский Проспект", 77, 131, 60.0076190963011, 30.2596873508359)
-line.AddStation("staraya_derevnya", "Старая Деревня", 77, 160, 59.9892698422187, 30.2551672192333)
-line.AddStation("krestovskii_ostrov", "Крестовский Остров", 77, 188, 59.9718506698449, 30.2596895969158)
-line.AddStation("chkalovskaya", "Чкаловская", 77, 218, 59.9610021114192, 30.2919371891426)
-line.AddStation("sportivnaya", "Спортивная", 77, 245, 59.9521996775544, 30.2914243907198)
-line.AddStation("admiralteyskaya", "Адмиралтейская", 163, 352, 59.935579, 30.315685)
-line.AddStation("sadovaya", "Садовая", 208, 397, 59.9265460035387, 30.3176918896198)
-line.AddStation("zvenigorodskaya", "Звенигородская", 287, 477, 59.922360424689, 30.3356744351351)
-line.AddStation("obvodyi_kanal", "Обводный Канал", 379, 596, 59.914571, 30.349632)
-line.AddStation("volkovskaya", "Волковская", 379, 624, 59.8960957956714, 30.3574116322867)
-line.AddStation("buharestskaya", "Бухарестская", 379, 652, 59.883611, 30.369444)
-line.AddStation("mejdynarodnaya", "Международная", 379, 680, 59.87, 30.379722)
-piter.AddChange('gostinii_dvor', 'nevskii_prospekt', 180)
-piter.AddChange('mayakovskaya', 'ploshad_vosstaniya', 180)
-piter.AddChange('ploshad_aleksandra_nevskogo_nevsk', 'ploshad_aleksandra_nevskogo_prav', 180)
-piter.AddChange('sadovaya', 'sennaya_ploshad', 180)
-piter.AddChange('sadovaya', 'spasskaya', 180)
-piter.AddChange('spasskaya', 'sennaya_ploshad', 180)
-piter.AddChange('dostoevskaya', 'vladimirskaya', 180)
-piter.AddChange('tehnologicheskii_instityt_kvl', 'tehnologicheskii_instityt_mosk', 180)
-piter.AddChange('zvenigorodskaya', 'pyshkinskaya', 180)
-piter.FillDefaultTimes(39)
-print("Piter, {} stations".format(piter.station_count))
-
-moscow = Metro("moscow", "Москва", 'Москвы')
-line = moscow.AddLine('sokolnicheskaya_liniya', 'Сокольническая линия', 'ed1c24')
-line.AddStation("ylica_podbelskogo", "Улица Подбельского", 607, 132, 55.8145329646495, 37.7337504744297)
-line.AddStation("cherkizovskaya", "Черкизовская", 607, 161, 55.8032729351313, 37.7467170092299)
-line.AddStation("preobrajenskaya_ploshad", "Преображенская площадь", 587, 178, 55.796157889621, 37.7152449519615)
-line.AddStation("sokolniki", "Сокольники", 568, 197, 55.7892616354543, 37.6797138681324)
-line.AddStation("krasnoselskaya", "Красносельская", 549, 215, 55.7801174241401, 37.6662874401897)
-line.AddStation("komsomolskaya_kr", "Комсомольская", 513, 252, 55.7749893674483, 37.6560826055666)
-line.AddStation("krasnie_vorota", "Красные ворота", 474, 271, 55.7688791370204, 37.6490966134596)
-line.AddStation("chistie_prydi", "Чистые пруды", 453, 289, 55.7652821242466, 37.6384808002614)
-line.AddStation("lybyanka", "Лубянка", 408, 337, 55.7601546540212, 37.625874958665)
-line.AddStation("ohotnii_ryad", "Охотный ряд", 375, 370, 55.7572501447119, 37.6173166444836)
-line.AddStation("biblioteka_im_lenina", "Библиотека им. Ленина", 343, 400, 55.7526999768777, 37.6109992836521)
-line.AddStation("kropotkinskaya", "Кропоткинская", 286, 457, 55.7451439240646, 37.602783501042)
-line.AddStation("park_kyltyri_kr", "Парк культуры", 265, 479, 55.7358450335055, 37.5945073381868)
-line.AddStation("frynzenskaya", "Фрунзенская", 251, 538, 55.727610079947, 37.5802236295585)
-line.AddStation("sportivnaya", "Спортивная", 227, 561, 55.7231139316859, 37.5639696522489)
-line.AddStation("vorobevi_gori", "Воробьевы горы", 199, 589, 55.7102488315714, 37.5591435377664)
-line.AddStation("yniversitet", "Университет", 177, 612, 55.69259362805, 37.5346727455108)
-line.AddStation("prospekt_vernadskogo", "Проспект Вернадского", 153, 635, 55.6769473973178, 37.5060930792933)
-line.AddStation("ugo-zapadnaya", "Юго-Западная", 153, 663, 55.6637734696351, 37.4833195605717)
-line = moscow.AddLine('zamoskvoretskaya_liniya', 'Замоскворецкая линия', '009854')
-line.AddStation("rechnoi_vokzal", "Речной вокзал", 188, 117, 55.8550927177238, 37.4763584047788)
-line.AddStation("vodnii_stadion", "Водный стадион", 188, 138, 55.8398451032555, 37.4871323722088)
-line.AddStation("voikovskaya", "Войковская", 188, 160, 55.8189257050376, 37.4977968171355)
-line.AddStation("sokol", "Сокол", 188, 184, 55.8049957790759, 37.5149771624959)
-line.AddStation("aeroport", "Аэропорт", 206, 201, 55.8008145135566, 37.5337097532744)
-line.AddStation("dinamo", "Динамо", 222, 218, 55.7898210936147, 37.5582326851342)
-line.AddStation("belorysskaya_zel", "Белорусская", 242, 237, 55.7765968858362, 37.5818786248922)
-line.AddStation("mayakovskaya", "Маяковская", 290, 286, 55.7694362254521, 37.5970093823579)
-line.AddStation("tverskaya", "Тверская", 338, 334, 55.7662652339699, 37.6052272386422)
-line.AddStation("teatralnaya", "Театральная", 389, 384, 55.7574096283081, 37.6188362564546)
-line.AddStation("novokyzneckaya", "Новокузнецкая", 389, 496, 55.7421341339971, 37.629594333576)
-line.AddStation("paveleckaya_zel", "Павелецкая", 434, 557, 55.729768818076, 37.6387625110374)
-line.AddStation("avtozavodskaya", "Автозаводская", 477, 601, 55.7071696324186, 37.6574458018926)
-line.AddStation("kolomenskaya", "Коломенская", 477, 651, 55.6783911195916, 37.6638941121713)
-line.AddStation("kashirskaya_zel", "Каширская", 477, 675, 55.6550875439577, 37.6490661704077)
-line.AddStation("kantemirovskaya", "Кантемировская", 477, 700, 55.6357865840338, 37.6566178650091)
-line.AddStation("caricino", "Царицыно", 494, 717, 55.6216590185028, 37.6701430514343)
-line.AddStation("orehovo", "Орехово", 512, 734, 55.6134990126532, 37.695685175318)
-line.AddStation("domodedovskaya", "Домодедовская", 529, 752, 55.6109583130938, 37.7195988327795)
-line.AddStation("krasnogvardeiskaya", "Красногвардейская", 546, 770, 55.6140481939377, 37.7445232639254)
-line.AddStation("almaatinskaya", "Алма-Атинская", 546, 795, 55.633475, 37.765633)
-line = moscow.AddLine('arbatsko-pokrovskaya_liniya', 'Арбатско-Покровcкая линия', '00539f')
-line.AddStation("shelkovskaya", "Щелковская", 627, 235, 55.8109250841654, 37.7985452142914)
-line.AddStation("pervomaiskaya", "Первомайская", 627, 260, 55.7945545415907, 37.7993616275653)
-line.AddStation("izmailovskaya", "Измайловская", 627, 284, 55.7876821076541, 37.7813865037381)
-line.AddStation("partizanskaya", "Партизанская", 627, 309, 55.7875765833999, 37.7486826814915)
-line.AddStation("semenovskaya", "Семеновская", 627, 338, 55.7832720937083, 37.7196988148305)
-line.AddStation("elektrozavodskaya", "Электрозаводская", 610, 356, 55.7822190260863, 37.7066890012092)
-line.AddStation("baymanskaya", "Бауманская", 592, 374, 55.772472556937, 37.6795233027091)
-line.AddStation("kyrskaya_sin", "Курская", 565, 399, 55.7582621743204, 37.6593339903959)
-line.AddStation("ploshad_revolucii", "Площадь Революции", 404, 400, 55.756922144145, 37.6226743592945)
-line.AddStation("arbatskaya_sin", "Арбатская", 313, 400, 55.7518377582274, 37.6040132591889)
-line.AddStation("smolenskaya_sin", "Смоленская", 270, 400, 55.7480073145646, 37.5836861467845)
-line.AddStation("kievskaya_sin", "Киевская", 206, 465, 55.7438910408958, 37.5672933836518)
-line.AddStation("park_pobedi", "Парк Победы", 111, 457, 55.7364409961909, 37.5146793512337)
-line.AddStation("slavyanskii_bylvar", "Славянский бульвар", 75, 421, 55.7295226943314, 37.4711104411516)
-line.AddStation("kyncevskaya_sin", "Кунцевская", 27, 370, 55.7307221435719, 37.446058754626)
-line.AddStation("molodejnaya", "Молодежная", 27, 335, 55.7409136609931, 37.4170590628804)
-line.AddStation("krilatskoe", "Крылатское", 27, 313, 55.7568639356345, 37.4081355232734)
-line.AddStation("strogino", "Строгино", 27, 246, 55.803784089029, 37.4025417480209)
-line.AddStation("myakinino", "Мякинино", 27, 209, 55.8249368342387, 37.3852176055605)
-line.AddStation("volokolamskaya", "Волоколамская", 27, 173, 55.8351578497631, 37.3825827972405)
-line.AddStation("mitino", "Митино", 27, 139, 55.8455902246608, 37.3625852786958)
-line.AddStation("pyatnitskoe_shosse", "Пятницкое шоссе", 27, 105, 55.853634, 37.353108)
-line = moscow.AddLine('filevskaya_liniya', 'Филевская линия', '009ddd')
-line.AddStation("kyncevskaya_fil", "Кунцевская (Филевская)", 49, 371, 55.7307954112642, 37.446009616004)
-line.AddStation("pionerskaya", "Пионерская", 67, 391, 55.7360278873923, 37.4671169547887)
-line.AddStation("filevskii_park", "Филевский парк", 83, 406, 55.7395539460918, 37.4833361280302)
-line.AddStation("bagrationovskaya", "Багратионовская", 98, 421, 55.7437379883965, 37.4977188191092)
-line.AddStation("fili", "Фили", 113, 437, 55.7461114404983, 37.5149309519302)
-line.AddStation("kytyzovskaya", "Кутузовская", 127, 451, 55.7399662088372, 37.5341798748651)
-line.AddStation("stydencheskaya", "Студенческая", 159, 483, 55.7386877747795, 37.5484841803272)
-line.AddStation("kievskaya_fil", "Киевская (Филевская)", 207, 436, 55.7441618474204, 37.5669310769079)
-line.AddStation("smolenskaya_fil", "Смоленская (Филевская)", 257, 387, 55.7493950652958, 37.5824093057416)
-line.AddStation("arbatskaya_fil", "Арбатская (Филевская)", 300, 387, 55.7524068663913, 37.6017552028193)
-line.AddStation("aleksandrovskii_sad", "Александровский сад", 328, 387, 55.7523004876049, 37.6100102730035)
-line = moscow.AddLine('kolcevaya_liniya', 'Кольцевая линия', '745d32')
-line.AddStation("paveleckaya_kl", "Павелецкая (Кольцевая)", 435, 537, 55.7316074402358, 37.6373390451641)
-line.AddStation("dobrininskaya", "Добрынинская", 401, 546, 55.7290611864152, 37.622594039598)
-line.AddStation("oktyabrskaya_kl", "Октябрьская (Кольцевая)", 327, 539, 55.7292579502018, 37.6112267797669)
-line.AddStation("park_kyltyri_kl", "Парк культуры (Кольцевая)", 251, 494, 55.7353776705526, 37.5936679167637)
-line.AddStation("kievskaya_kl", "Киевская (Кольцевая)", 221, 451, 55.7446816616271, 37.5673195392161)
-line.AddStation("krasnopresnenskaya", "Краснопресненская", 209, 338, 55.7605982500654, 37.5775481554019)
-line.AddStation("belorysskaya_kl", "Белорусская (Кольцевая)", 258, 253, 55.7757189562805, 37.5822436892428)
-line.AddStation("novoslobodskaya", "Новослободская", 331, 210, 55.7797079127576, 37.6015092940327)
-line.AddStation("prospekt_mira_kl", "Проспект Мира (Кольцевая)", 455, 225, 55.7798527191266, 37.6336962175341)
-line.AddStation("komsomolskaya_kl", "Комсомольская (Кольцевая)", 493, 253, 55.7746613830448, 37.6560374272919)
-line.AddStation("kyrskaya_kl", "Курская (Кольцевая)", 545, 400, 55.7581799984773, 37.6599285643101)
-line.AddStation("taganskaya_kl", "Таганская (Кольцевая)", 516, 475, 55.742372976687, 37.6534364079968)
-line = moscow.AddLine('kaluzhsko-rizhskaya_liniya', 'Калужско-Рижская линия', 'fbaa34')
-line.AddStation("medvedkovo", "Медведково", 505, 44, 55.8872198056911, 37.6615705750369)
-line.AddStation("babyshkinskaya", "Бабушкинская", 505, 71, 55.8696018716677, 37.6641531729066)
-line.AddStation("sviblovo", "Свиблово", 487, 89, 55.8554197738278, 37.6527128696718)
-line.AddStation("botanicheskii_sad", "Ботанический сад", 470, 106, 55.8454519850472, 37.6382309091642)
-line.AddStation("vdnh", "ВДНХ", 470, 132, 55.8210353720813, 37.6413180391564)
-line.AddStation("alekseevskaya", "Алексеевская", 470, 159, 55.8083000661719, 37.638982165517)
-line.AddStation("rijskaya", "Рижская", 470, 185, 55.7924140491293, 37.6365694226775)
-line.AddStation("prospekt_mira_or", "Проспект Мира", 470, 210, 55.7817711213755, 37.6338226473964)
-line.AddStation("syharevskaya", "Сухаревская", 454, 247, 55.772960593943, 37.6327948494404)
-line.AddStation("tyrgenevskaya", "Тургеневская", 454, 310, 55.7657173903248, 37.63738786512)
-line.AddStation("kitai-gorod_or", "Китай-город (Оранжевая)", 454, 414, 55.7549840759628, 37.632819222501)
-line.AddStation("tretyakovskaya_or", "Третьяковская (Оранжевая)", 391, 475, 55.7416720242377, 37.6279852054761)
-line.AddStation("oktyabrskaya_or", "Октябрьская", 341, 525, 55.730619218207, 37.6129028251401)
-line.AddStation("shabolovskaya", "Шаболовская", 326, 578, 55.7191764230145, 37.6082624863331)
-line.AddStation("leninskii_prospekt", "Ленинский проспект", 311, 593, 55.7074958388455, 37.5861632819777)
-line.AddStation("akademicheskaya", "Академическая", 295, 609, 55.6878708935511, 37.5735613932869)
-line.AddStation("profsouznaya", "Профсоюзная", 279, 625, 55.6779308416232, 37.5628687844352)
-line.AddStation("novie_cheremyshki", "Новые Черемушки", 263, 641, 55.6703155517091, 37.5544942666522)
-line.AddStation("kalyjskaya", "Калужская", 248, 656, 55.6571347079362, 37.5404968403609)
-line.AddStation("belyaevo", "Беляево", 233, 672, 55.6424642181538, 37.5263085205996)
-line.AddStation("konkovo", "Коньково", 233, 690, 55.6331135681431, 37.5193657102966)
-line.AddStation("teplii_stan", "Теплый Стан", 233, 709, 55.6188296190623, 37.5075130601728)
-line.AddStation("yasenevo", "Ясенево", 246, 724, 55.6060873664551, 37.5333097404951)
-line.AddStation("novoyasenevskaya", "Новоясеневская", 262, 741, 55.6014443131177, 37.554153269075)
-line = moscow.AddLine('tagansko-krasnopresnenskaya_liniya', 'Таганско-Краснопресненская линия', 'b41e8e')
-line.AddStation("planernaya", "Планерная", 139, 162, 55.860500801133, 37.4366871384151)
-line.AddStation("shodnenskaya", "Сходненская", 139, 189, 55.8504316657611, 37.4398114739516)
-line.AddStation("tyshinskaya", "Тушинская", 139, 222, 55.826321232012, 37.4369017630164)
-line.AddStation("shykinskaya", "Щукинская", 139, 245, 55.8085514026087, 37.4642174709607)
-line.AddStation("oktyabrskoe_pole", "Октябрьское поле", 139, 269, 55.7935072180172, 37.4936084071142)
-line.AddStation("polejaevskaya", "Полежаевская", 156, 287, 55.777539362395, 37.5192818481553)
-line.AddStation("begovaya", "Беговая", 173, 303, 55.7736864843681, 37.5468261144269)
-line.AddStation("ylica_1905_goda", "Улица 1905 года", 190, 320, 55.765053939476, 37.5615752956231)
-line.AddStation("barrikadnaya", "Баррикадная", 229, 338, 55.7608035124379, 37.58128813026)
-line.AddStation("pyshkinskaya", "Пушкинская", 319, 336, 55.7650697910311, 37.6067526814352)
-line.AddStation("kyzneckii_most", "Кузнецкий мост", 424, 353, 55.7612602954786, 37.6249079305951)
-line.AddStation("kitai-gorod_vio", "Китай-город (Фиолетовая)", 485, 414, 55.7554003223101, 37.6338310200866)
-line.AddStation("taganskaya_vio", "Таганская", 535, 465, 55.739614063447, 37.6530720186384)
-line.AddStation("proletarskaya", "Пролетарская", 581, 511, 55.7320223612723, 37.6677944251762)
-line.AddStation("volgogradskii_prospekt", "Волгоградский проспект", 610, 540, 55.7252793907609, 37.6865298999307)
-line.AddStation("tekstilshiki", "Текстильщики", 628, 558, 55.7092245671963, 37.7313369713417)
-line.AddStation("kyzminki", "Кузьминки", 645, 575, 55.7054530174972, 37.7654250647072)
-line.AddStation("ryazanskii_prospekt", "Рязанский проспект", 669, 576, 55.7168692271045, 37.7931354761886)
-line.AddStation("vihino", "Выхино", 694, 576, 55.7159646023232, 37.8178090012778)
-line = moscow.AddLine('kalininskaya_liniya', 'Калининская линия', 'ffd400')
-line.AddStation("novokisino", "Новокосино", 698, 392, 55.744708454753, 37.863254775219)
-line.AddStation("novogireevo", "Новогиреево", 680, 411, 55.7518688489458, 37.816680546334)
-line.AddStation("perovo", "Перово", 660, 429, 55.7511736483108, 37.7863397581296)
-line.AddStation("shosse_entyziastov", "Шоссе Энтузиастов", 642, 448, 55.7589012870796, 37.7521507941493)
-line.AddStation("aviamotornaya", "Авиамоторная", 623, 467, 55.7515620184703, 37.7170590251201)
-line.AddStation("ploshad_ilicha", "Площадь Ильича", 581, 485, 55.7469721149821, 37.6808757142437)
-line.AddStation("marksistskaya", "Марксистская", 535, 485, 55.7411431310035, 37.6565777481078)
-line.AddStation("tretyakovskaya_zh", "Третьяковская (Желтая)", 409, 485, 55.7411243839815, 37.6291930465031)
-line = moscow.AddLine('serpuhovsko-timiryazevskaya_liniya', 'Серпуховско-Тимирязевская линия', 'abadb0')
-line.AddStation("altyfevo", "Алтуфьево", 317, 20, 55.8979164889871, 37.587134939137)
-line.AddStation("bibirevo", "Бибирево", 333, 37, 55.8842754933877, 37.6026913409615)
-line.AddStation("otradnoe", "Отрадное", 333, 59, 55.8633869076221, 37.604850413685)
-line.AddStation("vladikino", "Владыкино", 333, 81, 55.8472811207559, 37.5898807710529)
-line.AddStation("petrovsko-razymovskaya", "Петровско-Разумовская", 317, 96, 55.8360431202466, 37.5748440790378)
-line.AddStation("timiryazevskaya", "Тимирязевская", 317, 123, 55.8184072151451, 37.5760080037778)
-line.AddStation("dmitrovskaya", "Дмитровская", 317, 146, 55.8075474370831, 37.5812008833455)
-line.AddStation("savelovskaya", "Савеловская", 317, 175, 55.7935212374439, 37.5883596061548)
-line.AddStation("mendeleevskaya", "Менделеевская", 317, 196, 55.7815311525213, 37.5997663021334)
-line.AddStation("cvetnoi_bylvar", "Цветной бульвар", 382, 264, 55.7720911430623, 37.6212564818892)
-line.AddStation("chehovskaya", "Чеховская", 329, 317, 55.7658078755777, 37.6075290899373)
-line.AddStation("borovickaya", "Боровицкая", 329, 417, 55.7517062709606, 37.6101586923623)
-line.AddStation("polyanka", "Полянка", 338, 481, 55.7368034041058, 37.6192178437938)
-line.AddStation("serpyhovskaya", "Серпуховская", 402, 567, 55.7269307330764, 37.6242187373292)
-line.AddStation("tylskaya", "Тульская", 402, 593, 55.7087409219019, 37.6226752963429)
-line.AddStation("nagatinskaya", "Нагатинская", 402, 616, 55.6831642634546, 37.6221337765917)
-line.AddStation("nagornaya", "Нагорная", 379, 639, 55.673227649678, 37.6111284544944)
-line.AddStation("nahimovskii_prospekt", "Нахимовский проспект", 379, 657, 55.6626542521309, 37.6052996623838)
-line.AddStation("sevastopolskaya", "Севастопольская", 379, 676, 55.6514310726072, 37.5984807065682)
-line.AddStation("chertanovskaya", "Чертановская", 379, 695, 55.641472119368, 37.605941794867)
-line.AddStation("ujnaya", "Южная", 397, 713, 55.6223634503418, 37.6086769692483)
-line.AddStation("prajskaya", "Пражская", 397, 732, 55.6122405285658, 37.6039809131235)
-line.AddStation("ylica_akademika_yangelya", "Улица Академика Янгеля", 397, 750, 55.5955230472478, 37.6008192711872)
-line.AddStation("annino", "Аннино", 397, 769, 55.5832532562542, 37.596838703327)
-line.AddStation("bylvar_dmitriya_donskogo", "Бульвар Дмитрия Донского", 363, 803, 55.5693873763878, 37.5763692691798)
-line = moscow.AddLine('lublinskaya_liniya', 'Люблинская линия', 'b3d335')
-line.AddStation("maryina_roscha", "Марьина роща", 403, 159, 55.7957982572654, 37.6155207486221)
-line.AddStation("dostoevskaya", "Достоевская", 403, 190, 55.7817420537442, 37.6137439800057)
-line.AddStation("trybnaya", "Трубная", 403, 265, 55.7674720681855, 37.6220601686407)
-line.AddStation("sretenskii_bylvar", "Сретенский бульвар", 436, 301, 55.766110855008, 37.6358221489846)
-line.AddStation("chkalovskaya", "Чкаловская", 556, 418, 55.7568245013459, 37.6591649191067)
-line.AddStation("rimskaya", "Римская", 581, 464, 55.7463639025237, 37.6800390212332)
-line.AddStation("krestyanskaya_zastava", "Крестьянская застава", 581, 532, 55.7324504713461, 37.6657301592817)
-line.AddStation("dybrovka", "Дубровка", 581, 568, 55.7172764783732, 37.6772188529301)
-line.AddStation("kojyhovskaya", "Кожуховская", 581, 593, 55.7062054359999, 37.6855970267035)
-line.AddStation("pechatniki", "Печатники", 604, 617, 55.6927055116029, 37.7281035384923)
-line.AddStation("voljskaya", "Волжская", 626, 640, 55.6907551038044, 37.7528312176472)
-line.AddStation("lublino", "Люблино", 626, 657, 55.6757564456767, 37.7614752997209)
-line.AddStation("bratislavskaya", "Братиславская", 626, 674, 55.6595003179762, 37.7508088672566)
-line.AddStation("marino", "Марьино", 626, 692, 55.6501547737319, 37.743907070821)
-line.AddStation("borisovo", "Борисово", 626, 714, 55.632504866956, 37.7432330407045)
-line.AddStation("shipilovskaya", "Шипиловская", 589, 751, 55.6212862484532, 37.7435819746988)
-line.AddStation("zyablikovo", "Зябликово", 568, 770, 55.6147239432002, 37.746204662916)
-line = moscow.AddLine('kahovskaya_liniya', 'Каховская линия', '0092b9')
-line.AddStation("kahovskaya", "Каховская", 400, 676, 55.6529984860912, 37.5982901683088)
-line.AddStation("varshavskaya", "Варшавская", 430, 676, 55.6534945739882, 37.619564432063)
-line.AddStation("kashirskaya_khv", "Каширская (Каховская)", 459, 676, 55.6552429161534, 37.6486914469033)
-line = moscow.AddLine('butovskaya_liniya', 'Бутовская линия легкого метро', '8ad7f8')
-line.AddStation("starokachalovskaya", "Старокачаловская", 344, 803, 55.5691961577774, 37.5761617824723)
-line.AddStation("ylica_skobelevskaya", "Улица Скобелевская", 344, 826, 55.5481532487645, 37.5547695293099)
-line.AddStation("bylvar_admirala_yshakova", "Бульвар Адмирала Ушакова", 344, 845, 55.5454191144993, 37.5430516256895)
-line.AddStation("ylica_gorchakova", "Улица Горчакова", 344, 865, 55.5417950203364, 37.530787918568)
-line.AddStation("byninskaya_alleya", "Бунинская аллея", 366, 865, 55.5381751922768, 37.5165348925232)
-# Остальные
-moscow.AddChange('chkalovskaya', 'kyrskaya_kl', 180)
-moscow.AddChange('chehovskaya', 'pyshkinskaya', 180)
-# Арбатско-покровская
-moscow.AddChange('kyncevskaya_sin', 'kyncevskaya_fil', 180)
-moscow.AddChange('kievskaya_sin', 'kievskaya_fil', 180)
-moscow.AddChange('kievskaya_sin', 'kievskaya_kl', 180)
-moscow.AddChange('arbatskaya_sin', 'borovickaya', 180)
-moscow.AddChange('arbatskaya_sin', 'aleksandrovskii_sad', 180)
-moscow.AddChange('arbatskaya_sin', 'biblioteka_im_lenina', 180)
-moscow.AddChange('ploshad_revolucii', 'teatralnaya', 180)
-moscow.AddChange('kyrskaya_sin', 'kyrskaya_kl', 180)
-moscow.AddChange('kyrskaya_sin', 'chkalovskaya', 180)
-moscow.AddChange('tretyakovskaya_or', 'tretyakovskaya_zh', 180)
-# Сокольническая
-moscow.AddChange('komsomolskaya_kr', 'komsomolskaya_kl', 180)
-moscow.AddChange('chistie_prydi', 'tyrgenevskaya', 180)
-moscow.AddChange('chistie_prydi', 'sretenskii_bylvar', 180)
-moscow.AddChange('lybyanka', 'kyzneckii_most', 180)
-moscow.AddChange('ohotnii_ryad', 'teatralnaya', 180)
-moscow.AddChange('biblioteka_im_lenina', 'borovickaya', 180)
-moscow.AddChange('biblioteka_im_lenina', 'aleksandrovskii_sad', 180)
-moscow.AddChange('park_kyltyri_kr', 'park_kyltyri_kl', 180)
-# Замоскворецкая
-moscow.AddChange('belorysskaya_zel', 'belorysskaya_kl', 180)
-moscow.AddChange('tverskaya', 'pyshkinskaya', 180)
-moscow.AddChange('tverskaya', 'chehovskaya', 180)
-moscow.AddChange('novokyzneckaya', 'tretyakovskaya_or', 180)
-moscow.AddChange('novokyzneckaya', 'tretyakovskaya_zh', 180)
-moscow.AddChange('paveleckaya_zel', 'paveleckaya_kl', 180)
-moscow.AddChange('kashirskaya_zel', 'kashirskaya_khv', 180)
-moscow.AddChange('krasnogvardeiskaya', 'zyablikovo', 180)
-# Филевская
-moscow.AddChange('kievskaya_fil', 'kievskaya_kl', 180)
-# Калужско-рижская
-moscow.AddChange('prospekt_mira_or', 'prospekt_mira_kl', 180)
-moscow.AddChange('tyrgenevskaya', 'sretenskii_bylvar', 180)
-moscow.AddChange('kitai-gorod_or', 'kitai-gorod_vio', 180)
-moscow.AddChange('tretyakovskaya_or', 'tretyakovskaya_zh', 180)
-moscow.AddChange('oktyabrskaya_or', 'oktyabrskaya_kl', 180)
-# Таганско-краснопресненская
-moscow.AddChange('barrikadnaya', 'krasnopresnenskaya', 180)
-moscow.AddChange('taganskaya_vio', 'marksistskaya', 180)
-moscow.AddChange('taganskaya_vio', 'taganskaya_kl', 180)
-moscow.AddChange('proletarskaya', 'krestyanskaya_zastava', 180)
-# Калининская
-moscow.AddChange('ploshad_ilicha', 'rimskaya', 180)
-moscow.AddChange('marksistskaya', 'taganskaya_kl', 180)
-# Серпуховская
-moscow.AddChange('novoslobodskaya', 'mendeleevskaya', 180)
-moscow.AddChange('cvetnoi_bylvar', 'trybnaya', 180)
-moscow.AddChange('serpyhovskaya', 'dobrininskaya', 180)
-moscow.AddChange('sevastopolskaya', 'kahovskaya', 180)
-moscow.AddChange('bylvar_dmitriya_donskogo', 'starokachalovskaya', 180)
-moscow.FillDefaultTimes(41.3)
-# close ring line
-moscow.AddTime('paveleckaya_kl', 'taganskaya_kl')
-line = moscow.lines['filevskaya_liniya']
-line.AddStation("vistavochnaya", "Выставочная", 159, 388, 55.7501978870751, 37.5427727388134)
-line.AddStation("mejdynarodnaya", "Международная", 159, 364, 55.7483038053698, 37.5334603045829)
-moscow.AddTime('kievskaya_fil', 'vistavochnaya')
-moscow.AddTime('vistavochnaya', 'mejdynarodnaya')
-print("Moscow, {} stations".format(moscow.station_count))
+        self._transfers.Set(st1, st2, time)
+        self._revision += 1
+        if _instrumentation is not None:
+            _instrumentation.Count('changes_added')
 
-try:
-    os.mkdir('json')
-except:
-    pass
+    def StationDistances(self, lat, lon):
+        # meters from (lat, lon) to every station in one vectorized pass, as (id, meters) pairs
+        if self._coordinates is None or len(self._coordinates[0]) != len(self._nodes):
+            lats = [station.lat for station in self._nodes]
+            lons = [station.lon for station in self._nodes]
+            if numpy is not None:
+                lats = numpy.array(lats, dtype=numpy.float64)
+                lons = numpy.array(lons, dtype=numpy.float64)
+            self._coordinates = (lats, lons)
+        dists = distances(lat, lon, *self._coordinates)
+        return list(zip(self._ids, (float(dist) for dist in dists)))
+
+    def SpatialIndex(self):
+        if self._spatial_index is None or len(self._spatial_index) != len(self._nodes):
+            self._spatial_index = SpatialIndex(self._ids, [station.lat for station in self._nodes],
+                                               [station.lon for station in self._nodes])
+        return self._spatial_index
+
+    def SearchIndex(self):
+        if self._search_index is None or len(self._search_index) != len(self._nodes):
+            names = [station.name for station in self._nodes]
+            self._search_index = StationSearch(self.id, self._ids, names, search_keys(self._ids, names))
+        return self._search_index
+
+    def Search(self, query, limit=10):
+        return self.SearchIndex().Search(query, limit)
+
+    def Nearest(self, lat, lon, k=1):
+        return self.SpatialIndex().Nearest(lat, lon, k)
+
+    def Within(self, lat, lon, radius_m):
+        return self.SpatialIndex().Within(lat, lon, radius_m)
+
+    def _Graph(self):
+        count = len(self._ids)
+        return self._rides.Csr(count), self._transfers.Csr(count)
+
+    def _Dijkstra(self, src, dst=None):
+        # returns distances and (parent, is change) predecessors over station indices
+        rides, transfers = self._Graph()
+        dist = [MATRIX_UNREACHABLE] * len(self._ids)
+        prev = {}
+        dist[src] = 0
+        heap = [(0, src)]
+        while heap:
+            time, station = heapq.heappop(heap)
+            if station == dst:
+                break
+            if time > dist[station]:
+                continue
+            for (offsets, neighbours, weights), is_change in ((rides, False), (transfers, True)):
+                for i in range(offsets[station], offsets[station + 1]):
+                    neighbour = neighbours[i]
+                    alt = time + weights[i]
+                    if alt < dist[neighbour]:
+                        dist[neighbour] = alt
+                        prev[neighbour] = (station, is_change)
+                        heapq.heappush(heap, (alt, neighbour))
+        return dist, prev
+
+    def AllPairsTimes(self):
+        # one full Dijkstra per source over dense station indices, row-major flat matrix
+        count = len(self._ids)
+        cells = array.array('I', [MATRIX_UNREACHABLE]) * (count * count)
+        for src in range(count):
+            dist, _ = self._Dijkstra(src)
+            cells[src * count:(src + 1) * count] = array.array('I', dist)
+        return list(self._ids), cells
+
+    def Route(self, src, dst):
+        src = self.__SearchStation(src)
+        dst = self.__SearchStation(dst)
+        dist, prev = self._Dijkstra(src, dst)
+        if dist[dst] == MATRIX_UNREACHABLE:
+            return None
+        return _make_route(self._ids, dist[dst], *_walk_back(prev, src, dst))
+
+    def ContractionHierarchy(self):
+        if self._hierarchy is None or self._hierarchy[0] != self._revision:
+            self._hierarchy = (self._revision, build_contraction_hierarchy(self))
+        return self._hierarchy[1]
+
+    def FastRoute(self, src, dst):
+        # Route over the contraction hierarchy, built on the first call after every change of the network
+        src = self.__SearchStation(src)
+        dst = self.__SearchStation(dst)
+        result = self.ContractionHierarchy().Search(src, dst)
+        return None if result is None else _make_route(self._ids, *result)
+
+    def ParetoRoutes(self, src, dst, max_transfers=4):
+        # routes that are not beaten on both travel time and number of changes, fewest changes first;
+        # Dijkstra over (station, changes so far) labels, a label is dropped if the same station was
+        # already reached as fast with no more changes
+        src = self.__SearchStation(src)
+        dst = self.__SearchStation(dst)
+        rides, transfers = self._Graph()
+        layers = max_transfers + 1
+        unreachable = MATRIX_UNREACHABLE
+        best = [unreachable] * (len(self._ids) * layers)
+        prev = {}
+        best[src * layers] = 0
+        heap = [(0, 0, src)]
+        found = []
+        while heap:
+            time, changes, station = heapq.heappop(heap)
+            state = station * layers + changes
+            if time > best[state]:
+                continue
+            if station == dst:
+                # popped in (time, changes) order, so this label is Pareto-optimal
+                if not found or changes < found[-1][1]:
+                    found.append((time, changes))
+                continue
+            for (offsets, neighbours, weights), is_change in ((rides, False), (transfers, True)):
+                next_changes = changes + is_change
+                if next_changes > max_transfers:
+                    continue
+                for i in range(offsets[station], offsets[station + 1]):
+                    neighbour = neighbours[i]
+                    alt = time + weights[i]
+                    base = neighbour * layers
+                    if any(best[base + k] <= alt for k in range(next_changes + 1)):
+                        continue
+                    best[base + next_changes] = alt
+                    prev[base + next_changes] = (state, is_change)
+                    heapq.heappush(heap, (alt, next_changes, neighbour))
+        routes = []
+        for time, changes in sorted(found, key=lambda label: label[1]):
+            path = [dst]
+            kinds = []
+            state = dst * layers + changes
+            while state != src * layers:
+                state, is_change = prev[state]
+                path.append(state // layers)
+                kinds.append(is_change)
+            path.reverse()
+            kinds.reverse()
+            routes.append(_make_route(self._ids, time, path, kinds))
+        return routes
+
+    def _SearchPath(self, src, dst, lower, banned_nodes=(), banned_edges=()):
+        # A* with exact distances to dst on the full graph as the heuristic; returns
+        # (seconds, path, kinds) avoiding banned station indices and (st1, st2) edges
+        rides, transfers = self._Graph()
+        dist = {src: 0}
+        prev = {}
+        heap = [(lower[src], 0, src)]
+        while heap:
+            _, time, station = heapq.heappop(heap)
+            if station == dst:
+                return (time,) + _walk_back(prev, src, dst)
+            if time > dist[station]:
+                continue
+            for (offsets, neighbours, weights), is_change in ((rides, False), (transfers, True)):
+                for i in range(offsets[station], offsets[station + 1]):
+                    neighbour = neighbours[i]
+                    if neighbour in banned_nodes or (station, neighbour) in banned_edges:
+                        continue
+                    alt = time + weights[i]
+                    if alt < dist.get(neighbour, MATRIX_UNREACHABLE):
+                        dist[neighbour] = alt
+                        prev[neighbour] = (station, is_change)
+                        heapq.heappush(heap, (alt + lower[neighbour], alt, neighbour))
+        return None
+
+    def _EdgeWeight(self, st1, st2, is_change):
+        return (self._transfers if is_change else self._rides).Get(st1, st2)
+
+    def KShortestRoutes(self, src, dst, k=3):
+        # Yen's algorithm over loopless station sequences, fastest first; only the k - len(found)
+        # best candidates are kept and spur searches that cant beat them are skipped
+        src = self.__SearchStation(src)
+        dst = self.__SearchStation(dst)
+        if k <= 0:
+            return []
+        lower, _ = self._Dijkstra(dst)
+        if lower[src] == MATRIX_UNREACHABLE:
+            return []
+        found = [self._SearchPath(src, dst, lower)]
+        candidates = []
+        seen = {tuple(found[0][1])}
+        while len(found) < k:
+            _, last_path, last_kinds = found[-1]
+            root_time = 0
+            for i in range(len(last_path) - 1):
+                spur = last_path[i]
+                root = last_path[:i + 1]
+                if i:
+                    root_time += self._EdgeWeight(last_path[i - 1], spur, last_kinds[i - 1])
+                room = k - len(found)
+                if len(candidates) >= room and root_time + lower[spur] >= max(candidates)[0]:
+                    continue
+                banned_edges = set()
+                for _, path, _ in found:
+                    if path[:i + 1] == root:
+                        banned_edges.add((path[i], path[i + 1]))
+                        banned_edges.add((path[i + 1], path[i]))
+                result = self._SearchPath(spur, dst, lower, set(root[:-1]), banned_edges)
+                if result is None:
+                    continue
+                spur_time, spur_path, spur_kinds = result
+                path = root[:-1] + spur_path
+                if tuple(path) in seen:
+                    continue
+                seen.add(tuple(path))
+                candidate = (root_time + spur_time, path, last_kinds[:i] + spur_kinds)
+                if len(candidates) < room:
+                    candidates.append(candidate)
+                elif candidate[0] < max(candidates)[0]:
+                    candidates.remove(max(candidates))
+                    candidates.append(candidate)
+            if not candidates:
+                break
+            candidates.sort()
+            found.append(candidates.pop(0))
+        return [_make_route(self._ids, *route) for route in found]
+
+    def _Isochrones(self, sources, thresholds):
+        # bounded Dijkstra per source; the distance buffer is allocated once and only the
+        # stations touched by the previous source are reset
+        rides, transfers = self._Graph()
+        count = len(self._ids)
+        limit = thresholds[-1]
+        unreachable = MATRIX_UNREACHABLE
+        dist = [unreachable] * count
+        touched = []
+        buckets = bytearray(count)
+        for src in sources:
+            for station in touched:
+                dist[station] = unreachable
+            del touched[:]
+            buckets[:] = bytes([ISOCHRONE_OUTSIDE]) * count
+            dist[src] = 0
+            touched.append(src)
+            heap = [(0, src)]
+            while heap:
+                time, station = heapq.heappop(heap)
+                if time > dist[station]:
+                    continue
+                buckets[station] = bisect.bisect_left(thresholds, time)
+                for offsets, neighbours, weights in (rides, transfers):
+                    for i in range(offsets[station], offsets[station + 1]):
+                        neighbour = neighbours[i]
+                        alt = time + weights[i]
+                        if alt <= limit and alt < dist[neighbour]:
+                            if dist[neighbour] == unreachable:
+                                touched.append(neighbour)
+                            dist[neighbour] = alt
+                            heapq.heappush(heap, (alt, neighbour))
+            yield src, buckets
+
+    def Isochrones(self, src, thresholds):
+        # {threshold seconds: [station ids first reached within it]} for one source
+        thresholds = _isochrone_thresholds(thresholds)
+        _, buckets = next(self._Isochrones([self.__SearchStation(src)], thresholds))
+        result = collections.OrderedDict((threshold, []) for threshold in thresholds)
+        for id, bucket in zip(self._ids, buckets):
+            if bucket != ISOCHRONE_OUTSIDE:
+                result[thresholds[bucket]].append(id)
+        return result
+
+    def SetHeadways(self, line_id, profile):
+        # profile is [(start, end, headway)] in seconds since the start of the service day
+        # (end may be past 24:00); outside every window the line does not run
+        if line_id not in self.lines:
+            raise MetroError("Cant find line '{}'".format(line_id))
+        windows = []
+        for start, end, headway in profile:
+            start, end, headway = parse_clock(start), parse_clock(end), parse_clock(headway)
+            if start > end or headway <= 0:
+                raise MetroError("Bad headway window ({}, {}, {}) on line '{}'".format(start, end, headway, line_id))
+            windows.append((start, end, headway))
+        self._headways[line_id] = sorted(windows)
+        self._revision += 1
+
+    def CloseStation(self, id, start, end):
+        # nobody enters, leaves or changes at the station in [start, end), trains pass through
+        self._station_closures.setdefault(self.__SearchStation(id), []).append((parse_clock(start), parse_clock(end)))
+        self._revision += 1
+
+    def CloseSegment(self, st1, st2, start, end):
+        # no departures over the ride segment or change between st1 and st2 in [start, end)
+        st1 = self.__SearchStation(st1)
+        st2 = self.__SearchStation(st2)
+        if self._rides.Get(st1, st2) is None and self._transfers.Get(st1, st2) is None:
+            raise MetroError("No segment between '{}' and '{}'".format(self._ids[st1], self._ids[st2]))
+        key = self._rides._Key(st1, st2)
+        self._segment_closures.setdefault(key, []).append((parse_clock(start), parse_clock(end)))
+        self._revision += 1
+
+    def _NextDeparture(self, station, time):
+        windows = self._headways.get(self._node_lines[station].id)
+        if windows is None:
+            return time
+        for start, end, headway in windows:
+            if time <= start:
+                return start
+            if time <= end:
+                departure = start + -(-(time - start) // headway) * headway
+                if departure <= end:
+                    return departure
+        return None
+
+    def EarliestArrival(self, src, dst, departure):
+        # time-dependent Dijkstra over (station, on board) states. Off board, boarding waits for the
+        # next train of the station's line that may leave over the segment from an open station and
+        # changes wait for the change and both its stations to be open. On board, a passenger can stay
+        # on at a closed station or before a closed segment and go on once it reopens. Waiting is
+        # allowed everywhere, so no move arrives earlier for starting later and the search is exact
+        src = self.__SearchStation(src)
+        dst = self.__SearchStation(dst)
+        departure = parse_clock(departure)
+        station_closures = self._station_closures
+        segment_closures = self._segment_closures
+        key = self._rides._Key
+
+        def reopened(closures, time):
+            # earliest moment at or after time outside every [start, end) window of closures
+            moved = closures is not None
+            while moved:
+                moved = False
+                for start, end in closures:
+                    if start <= time < end:
+                        time = end
+                        moved = True
+            return time
+
+        def board(station, neighbour, time):
+            # earliest departure over the ride segment at or after time, None if there is none
+            while time is not None:
+                time = self._NextDeparture(station, time)
+                if time is None:
+                    break
+                opened = reopened(segment_closures.get(key(station, neighbour)),
+                                  reopened(station_closures.get(station), time))
+                if opened == time:
+                    break
+                time = opened
+            return time
+
+        def walk(station, neighbour, time, seconds):
+            # earliest start of the change at or after time
+            while True:
+                start = reopened(segment_closures.get(key(station, neighbour)),
+                                 reopened(station_closures.get(station), time))
+                start = reopened(station_closures.get(neighbour), start + seconds) - seconds
+                if start == time:
+                    return time
+                time = start
+
+        (ride_offsets, ride_neighbours, ride_weights), (change_offsets, change_neighbours, change_weights) = self._Graph()
+        unreachable = float('inf')
+        arrival = [unreachable] * (2 * len(self._ids))
+        prev = {}
+        arrival[src * 2] = departure
+        heap = [(departure, src * 2)]
+        while heap:
+            time, state = heapq.heappop(heap)
+            if time > arrival[state]:
+                continue
+            station, on_board = divmod(state, 2)
+            if station == dst and not on_board:
+                break
+            moves = []
+            if on_board:
+                moves.append((station * 2, reopened(station_closures.get(station), time), None))
+            for i in range(ride_offsets[station], ride_offsets[station + 1]):
+                neighbour = ride_neighbours[i]
+                if on_board:
+                    ride_departure = reopened(segment_closures.get(key(station, neighbour)), time)
+                else:
+                    ride_departure = board(station, neighbour, time)
+                if ride_departure is not None:
+                    moves.append((neighbour * 2 + 1, ride_departure + ride_weights[i], False))
+            if not on_board:
+                for i in range(change_offsets[station], change_offsets[station + 1]):
+                    neighbour = change_neighbours[i]
+                    walked = walk(station, neighbour, time, change_weights[i]) + change_weights[i]
+                    moves.append((neighbour * 2, walked, True))
+            for next_state, next_time, is_change in moves:
+                if next_time < arrival[next_state]:
+                    arrival[next_state] = next_time
+                    prev[next_state] = (state, is_change)
+                    heapq.heappush(heap, (next_time, next_state))
+        if arrival[dst * 2] == unreachable:
+            return None
+        ids = self._ids
+        stations = [ids[dst]]
+        transfers = []
+        state = dst * 2
+        while state != src * 2:
+            parent, is_change = prev[state]
+            if is_change:
+                transfers.append((ids[parent // 2], ids[state // 2]))
+            if ids[parent // 2] != stations[-1]:
+                stations.append(ids[parent // 2])
+            state = parent
+        stations.reverse()
+        transfers.reverse()
+        return MetroJourney(departure, arrival[dst * 2], stations, transfers)
+
+
+class RouteCache(object):
+    # bounded LRU cache of Metro query results keyed by (city, query, src, dst, options); entries of
+    # a city are dropped as soon as its Metro.revision moves, optionally they also expire after ttl seconds
+    def __init__(self, maxsize=4096, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        # city -> (Metro, revision the cached entries were computed at, their keys)
+        self._cities = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def Stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations, 'invalidations': self.invalidations}
+
+    def Clear(self):
+        self._entries.clear()
+        self._cities.clear()
+
+    def _Drop(self, key):
+        del self._entries[key]
+        self._cities[key[0]][2].discard(key)
+
+    def _CheckCity(self, metro):
+        city = self._cities.get(metro.id)
+        if city is not None and (city[0] is not metro or city[1] != metro.revision):
+            for key in city[2]:
+                del self._entries[key]
+            self.invalidations += len(city[2])
+            city = None
+        if city is None:
+            city = self._cities[metro.id] = (metro, metro.revision, set())
+        return city
+
+    def Get(self, metro, query, src, dst, *options):
+        # result of metro.<query>(src, dst, *options), computed on a miss
+        keys = self._CheckCity(metro)[2]
+        key = (metro.id, query, src, dst) + options
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] is None or entry[1] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._Drop(key)
+            self.expirations += 1
+        self.misses += 1
+        result = getattr(metro, query)(src, dst, *options)
+        self._entries[key] = (result, None if self.ttl is None else self._clock() + self.ttl)
+        keys.add(key)
+        while len(self._entries) > self.maxsize:
+            self._Drop(next(iter(self._entries)))
+            self.evictions += 1
+        return result
+
+    def Route(self, metro, src, dst):
+        return self.Get(metro, 'Route', src, dst)
+
+    def EarliestArrival(self, metro, src, dst, departure):
+        return self.Get(metro, 'EarliestArrival', src, dst, departure)
+
+    def ParetoRoutes(self, metro, src, dst, max_transfers=4):
+        return self.Get(metro, 'ParetoRoutes', src, dst, max_transfers)
+
+    def KShortestRoutes(self, metro, src, dst, k=3):
+        return self.Get(metro, 'KShortestRoutes', src, dst, k)
+
+
+@_timed('build_metro')
+def build_metro(definition):
+    metro = Metro(definition['id'], definition['name'], definition['accusative_name'])
+    for line in definition['lines']:
+        metro.AddLine(line['id'], line['name'], line['color']).AddStations(line['stations'])
+    for change in definition.get('changes', ()):
+        metro.AddChange(*change)
+    metro.FillDefaultTimes(definition.get('speed', 41))
+    # branch stations are added after FillDefaultTimes and connected through 'times'
+    for line in definition['lines']:
+        if 'branch' in line:
+            metro.lines[line['id']].AddStations(line['branch'])
+    # segments FillDefaultTimes cant infer from station order, e.g. closing a ring line
+    for time in definition.get('times', ()):
+        metro.AddTime(*time)
+    for line in definition['lines']:
+        if 'headways' in line:
+            metro.SetHeadways(line['id'], line['headways'])
+    closures = definition.get('closures', {})
+    for closure in closures.get('stations', ()):
+        metro.CloseStation(*closure)
+    for closure in closures.get('segments', ()):
+        metro.CloseSegment(*closure)
+    return metro
+
+
+def load_metro(path):
+    with open(path, encoding='utf-8') as f:
+        return build_metro(json.load(f))
+
+
+CITIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cities')
+_metros = {}
+
+
+def city_names(cities_dir=CITIES_DIR):
+    return sorted(name[:-len('.json')] for name in os.listdir(cities_dir) if name.endswith('.json'))
+
+
+def get_metro(city, cities_dir=CITIES_DIR):
+    key = (cities_dir, city)
+    if key not in _metros:
+        path = os.path.join(cities_dir, '{}.json'.format(city))
+        if not os.path.exists(path):
+            raise MetroError("Unknown city '{}'".format(city))
+        _metros[key] = load_metro(path)
+    return _metros[key]
+
+
+# longest believable ride between neighbouring stations and change, in seconds
+VALIDATE_MAX_RIDE = 20 * 60
+VALIDATE_MAX_CHANGE = 15 * 60
+
+ValidationProblem = collections.namedtuple('ValidationProblem', ['kind', 'message'])
+
+
+def validate_metro(metro):
+    # ValidationProblems of a built network in one pass over its stations and segments
+    problems = []
+    ids = metro._ids
+    count = len(ids)
+    parent = list(range(count))
+
+    def find(station):
+        while parent[station] != station:
+            parent[station] = parent[parent[station]]
+            station = parent[station]
+        return station
+
+    has_ride = bytearray(count)
+    for edges, is_change in ((metro._rides, False), (metro._transfers, True)):
+        kind, limit = ('change', VALIDATE_MAX_CHANGE) if is_change else ('ride', VALIDATE_MAX_RIDE)
+        for st1, st2, weight in zip(edges.src, edges.dst, edges.weight):
+            parent[find(st1)] = find(st2)
+            if not is_change:
+                has_ride[st1] = has_ride[st2] = 1
+            if weight == 0:
+                problems.append(ValidationProblem('zero_time', "Zero {} time between '{}' and '{}'".format(
+                    kind, ids[st1], ids[st2])))
+            elif weight > limit:
+                problems.append(ValidationProblem('absurd_time', "{} seconds {} between '{}' and '{}'".format(
+                    weight, kind, ids[st1], ids[st2])))
+    for st1, st2 in zip(metro._transfers.src, metro._transfers.dst):
+        reason = None
+        if st1 == st2:
+            reason = 'to itself'
+        elif metro._node_lines[st1] is metro._node_lines[st2]:
+            reason = "within line '{}'".format(metro._node_lines[st1].id)
+        elif not has_ride[st1] or not has_ride[st2]:
+            reason = 'to a station no train stops at'
+        elif metro._rides.Get(st1, st2) is not None:
+            reason = 'between stations also connected by a ride'
+        if reason is not None:
+            problems.append(ValidationProblem('orphan_change', "Change between '{}' and '{}' {}".format(
+                ids[st1], ids[st2], reason)))
+    components = collections.defaultdict(list)
+    for station in range(count):
+        components[find(station)].append(station)
+    if len(components) > 1:
+        # everything outside the largest component is reported
+        largest = max(components.values(), key=len)
+        for component in components.values():
+            if component is not largest:
+                problems.append(ValidationProblem('disconnected', '{} station(s) cut off from the network: {}'.format(
+                    len(component), ', '.join(ids[station] for station in component[:10]))))
+    return problems
+
+
+def validate_definition(definition):
+    # ValidationProblems of a <city>.json definition: the ones that stop build_metro first,
+    # then those of the network it builds
+    problems = []
+
+    def number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def shaped(entry, sizes, ids):
+        # a list of one of sizes fields starting with ids station ids, so the checks below can index it
+        return isinstance(entry, (list, tuple)) and len(entry) in sizes and all(
+            isinstance(id, str) for id in entry[:ids])
+
+    lines = {}
+    for line in definition['lines']:
+        for row in itertools.chain(line['stations'], line.get('branch', ())):
+            if not shaped(row, (6,), 2) or not all(number(value) for value in row[2:]):
+                problems.append(ValidationProblem('bad_station', "Expected [id, name, x, y, lat, lon] on line '{}', "
+                                                  "got {}".format(line['id'], row)))
+            elif row[0] in lines:
+                problems.append(ValidationProblem('duplicate_station', "Station '{}' is on both '{}' and '{}'".format(
+                    row[0], lines[row[0]], line['id'])))
+            else:
+                lines[row[0]] = line['id']
+    changes = {}
+    for entry in definition.get('changes', ()):
+        if not shaped(entry, (2, 3), 2) or len(entry) == 3 and not (
+                isinstance(entry[2], int) and not isinstance(entry[2], bool) and entry[2] >= 0):
+            problems.append(ValidationProblem('bad_change', 'Expected [from, to] or [from, to, seconds] in change, '
+                                              'got {}'.format(entry)))
+            continue
+        for id in entry[:2]:
+            if id not in lines:
+                problems.append(ValidationProblem('unknown_station', "Unknown station '{}' in change {}".format(
+                    id, entry)))
+        time = entry[2] if len(entry) > 2 else 180
+        key = tuple(sorted(entry[:2]))
+        if changes.setdefault(key, time) != time:
+            problems.append(ValidationProblem('asymmetric_time', "Change between '{}' and '{}' is given "
+                                              "as {} and {} seconds".format(key[0], key[1], changes[key], time)))
+    for entry in definition.get('times', ()):
+        if not shaped(entry, (2, 3), 2) or len(entry) == 3 and not (number(entry[2]) and entry[2] > 0):
+            problems.append(ValidationProblem('bad_time', 'Expected [from, to] or [from, to, speed] in time, '
+                                              'got {}'.format(entry)))
+            continue
+        for id in entry[:2]:
+            if id not in lines:
+                problems.append(ValidationProblem('unknown_station', "Unknown station '{}' in time {}".format(
+                    id, entry)))
+    line_ids = set()
+    for line in definition['lines']:
+        if line['id'] in line_ids:
+            problems.append(ValidationProblem('duplicate_line', "Line '{}' is defined twice".format(line['id'])))
+        line_ids.add(line['id'])
+
+    def clock(value, where):
+        try:
+            return parse_clock(value)
+        except (MetroError, ValueError, TypeError):
+            problems.append(ValidationProblem('bad_clock', "Bad clock time {!r} in {}".format(value, where)))
+
+    for line in definition['lines']:
+        for window in line.get('headways', ()):
+            where = "headways of line '{}'".format(line['id'])
+            if not shaped(window, (3,), 0):
+                problems.append(ValidationProblem('bad_headway', 'Expected [start, end, headway] in {}, got {}'.format(
+                    where, window)))
+                continue
+            start, end, headway = [clock(value, where) for value in window]
+            if None not in (start, end, headway) and (start > end or headway <= 0):
+                problems.append(ValidationProblem('bad_headway', 'Bad window {} in {}'.format(window, where)))
+    closures = definition.get('closures', {})
+    for entries, kind, count in ((closures.get('stations', ()), 'station closure', 1),
+                                 (closures.get('segments', ()), 'segment closure', 2)):
+        for entry in entries:
+            if not shaped(entry, (count + 2,), count):
+                problems.append(ValidationProblem('bad_closure', 'Expected {} station id(s), start and end in {} {}'.format(
+                    count, kind, entry)))
+                continue
+            for id in entry[:count]:
+                if id not in lines:
+                    problems.append(ValidationProblem('unknown_station', "Unknown station '{}' in {} {}".format(
+                        id, kind, entry)))
+            for value in entry[count:]:
+                clock(value, '{} {}'.format(kind, entry))
+    if problems:
+        return problems
+    try:
+        metro = build_metro(definition)
+    except MetroError as e:
+        # e.g. a segment closure between stations that are not neighbours
+        return [ValidationProblem('invalid', str(e))]
+    return validate_metro(metro)
+
+
+# bump when a change to this script changes the exported files for the same definitions
+GENERATOR_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def write_metro_json(metro, path):
+    writer = AtomicWriter(path)
+    with writer as f:
+        json_dump(metro, f)
+    return writer.changed
+
+
+def exporters(options):
+    # (file name format, writer(metro, path), settings that change the file) of every requested export
+    result = [('{}.json', write_metro_json, None)]
+    if options.matrix:
+        result.append(('{}.matrix', write_time_matrix, None))
+    if options.binary:
+        result.append(('{}.mbin', write_metro_binary, None))
+    if options.isochrones:
+        thresholds = [minutes * 60 for minutes in options.isochrone_minutes]
+        result.append(('{}.iso', functools.partial(write_isochrones, thresholds=thresholds), thresholds))
+    if options.contraction:
+        result.append(('{}.ch', write_contraction_hierarchy, None))
+    if options.search:
+        result.append(('{}.search.json', write_search_index, None))
+    return result
+
+
+def export_names(city, options):
+    return [name.format(city) for name, _, _ in exporters(options)]
+
+
+def definition_hash(city, options):
+    with open(os.path.join(options.cities_dir, '{}.json'.format(city)), encoding='utf-8') as f:
+        definition = json.load(f)
+    settings = [(name.format(city), setting) for name, _, setting in exporters(options)]
+    digest = hashlib.sha256()
+    digest.update(json.dumps([GENERATOR_VERSION, settings, definition],
+                             sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def export_city(city, options):
+    # returns the city name, station count, files that changed and instrumentation results if enabled
+    instrumentation = enable_instrumentation() if options.profile_json else None
+    try:
+        metro = get_metro(city, options.cities_dir)
+        written = []
+        for name, write, _ in exporters(options):
+            # phases are named after the file suffix, e.g. export.json
+            phase = 'export' + name.format('')
+            name = name.format(city)
+            with _phase(phase):
+                changed = write(metro, os.path.join(options.output_dir, name))
+            if changed:
+                written.append(name)
+    finally:
+        if instrumentation is not None:
+            disable_instrumentation()
+    return metro.name, metro.station_count, written, instrumentation and instrumentation.Snapshot()
+
+
+def build(cities, options):
+    # every city is built and exported independently, results come back in the order given
+    if options.jobs == 1 or len(cities) < 2:
+        return [export_city(city, options) for city in cities]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        return list(executor.map(export_city, cities, [options] * len(cities)))
+
+
+def read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_dir, manifest):
+    with AtomicWriter(os.path.join(output_dir, MANIFEST_NAME)) as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate json/<city>.json metro networks')
+    parser.add_argument('--cities-dir', default=CITIES_DIR,
+                        help='directory with <city>.json network definitions')
+    parser.add_argument('--output-dir', default='json',
+                        help='directory the exports are written to')
+    parser.add_argument('--cities', type=lambda value: [city for city in value.split(',') if city],
+                        help='comma separated list of cities to build, all by default')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild cities even if their definition did not change')
+    parser.add_argument('--matrix', action='store_true',
+                        help='also write the all-pairs travel time matrix to <city>.matrix')
+    parser.add_argument('--binary', action='store_true',
+                        help='also write the compact binary network to <city>.mbin')
+    parser.add_argument('--isochrones', action='store_true',
+                        help='also write per-station isochrones to <city>.iso')
+    parser.add_argument('--isochrone-minutes', default=DEFAULT_ISOCHRONE_MINUTES,
+                        type=lambda value: sorted(int(minutes) for minutes in value.split(',')),
+                        help='comma separated isochrone thresholds in minutes, default {}'.format(
+                            ','.join(map(str, DEFAULT_ISOCHRONE_MINUTES))))
+    parser.add_argument('--contraction', action='store_true',
+                        help='also write the contraction hierarchy for fast route queries to <city>.ch')
+    parser.add_argument('--search', action='store_true',
+                        help='also write the station name search index to <city>.search.json')
+    parser.add_argument('--validate', action='store_true',
+                        help='check the city definitions instead of building them, exit status 1 on problems')
+    parser.add_argument('--profile-json', metavar='PATH',
+                        help='write per-city phase timers and counters of the build as JSON')
+    parser.add_argument('--cprofile', metavar='PATH',
+                        help='write cProfile stats of the build, runs it in this process')
+    args = parser.parse_args(argv)
+
+    available = city_names(args.cities_dir)
+    cities = args.cities or available
+    for city in cities:
+        if city not in available:
+            parser.error("unknown city '{}', expected one of {}".format(city, ', '.join(available)))
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.cprofile:
+        args.jobs = 1
+
+    if args.validate:
+        failed = False
+        for city in cities:
+            with open(os.path.join(args.cities_dir, '{}.json'.format(city)), encoding='utf-8') as f:
+                problems = validate_definition(json.load(f))
+            for problem in problems:
+                print('{}: {}'.format(city, problem.message))
+            print('{}, {}'.format(city, '{} problem(s)'.format(len(problems)) if problems else 'ok'))
+            failed = failed or bool(problems)
+        parser.exit(1 if failed else 0)
+
+    try:
+        os.mkdir(args.output_dir)
+    except OSError:
+        pass
+
+    manifest = read_manifest(args.output_dir)
+    hashes = {city: definition_hash(city, args) for city in cities}
+    stale = []
+    for city in cities:
+        entry = manifest.get(city, {})
+        exists = all(os.path.exists(os.path.join(args.output_dir, name)) for name in entry.get('files', ()))
+        if args.force or entry.get('hash') != hashes[city] or not exists:
+            stale.append(city)
+        else:
+            print("{}, unchanged".format(city))
+
+    profile = cProfile.Profile() if args.cprofile else None
+    if profile is not None:
+        profile.enable()
+    results = build(stale, args)
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(args.cprofile)
+
+    total = Instrumentation()
+    report = collections.OrderedDict()
+    for city, (_, station_count, written, stats) in zip(stale, results):
+        print("{}, {} stations, {} written".format(city, station_count, ', '.join(written) or 'nothing'))
+        manifest[city] = {'hash': hashes[city], 'files': export_names(city, args)}
+        if stats is not None:
+            report[city] = stats
+            total.Merge(stats)
+    if stale:
+        write_manifest(args.output_dir, manifest)
+    if args.profile_json:
+        with open(args.profile_json, 'w') as f:
+            json.dump({'cities': report, 'total': total.Snapshot()}, f, indent=2)
 
-open('json/samara.json', 'w').write(json_repr(samara))
-open('json/novosib.json', 'w').write(json_repr(novosib))
-open('json/kazan.json', 'w').write(json_repr(kazan))
-open('json/moscow.json', 'w').write(json_repr(moscow))
-open('json/piter.json', 'w').write(json_repr(piter))
-open('json/eburg.json', 'w').write(json_repr(eburg))
-open('json/nn.json', 'w').write(json_repr(nn))
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# HTTP/1.1 query service over the city networks, stdlib asyncio only.
+#
+#   python metroserver.py [--host 127.0.0.1] [--port 8080] [--jobs N]
+#
+# GET  /stations                          cities
+# GET  /stations?city=moscow              stations of a city
+# GET  /route?city=&from=&to=             fastest route; &depart=HH:MM for the time-dependent
+#                                         search, &pareto=1 or &alternatives=K for more options
+# POST /route {"city": ..., "pairs": [[from, to], ...], "depart": ...}   many routes in one call
+# GET  /nearest?city=&lat=&lon=[&k=5|&radius=M][&to=station]   stations near a point, with the
+#                                         travel time from each of them to `to`
+# GET  /search?q=[&city=][&limit=10]      stations by name or id prefix, typos allowed, all cities by default
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import urllib.parse
+
+import generatemetro
+
+MAX_BODY = 1 << 20
+MAX_BATCH = 10000
+MAX_ALTERNATIVES = 10
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+# per process: cities loaded by load_cities and their query cache
+_metros = {}
+_cache = None
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super(HttpError, self).__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+def load_cities(cities_dir=generatemetro.CITIES_DIR, cache_size=4096):
+    global _cache
+    for city in generatemetro.city_names(cities_dir):
+        _metros[city] = generatemetro.get_metro(city, cities_dir)
+    _cache = generatemetro.RouteCache(cache_size)
+
+
+def _Metro(city):
+    if city not in _metros:
+        raise HttpError(404, "Unknown city '{}'".format(city))
+    return _metros[city]
+
+
+def _RouteJson(route):
+    return None if route is None else route._asdict()
+
+
+def route_query(city, src, dst, depart=None, pareto=False, alternatives=0):
+    # runs in a pool worker; returns JSON-ready data or raises HttpError
+    metro = _Metro(city)
+    try:
+        if depart is not None:
+            return _RouteJson(_cache.EarliestArrival(metro, src, dst, generatemetro.parse_clock(depart)))
+        if pareto:
+            return [_RouteJson(route) for route in _cache.ParetoRoutes(metro, src, dst)]
+        if alternatives:
+            return [_RouteJson(route) for route in _cache.KShortestRoutes(metro, src, dst, alternatives)]
+        return _RouteJson(_cache.Route(metro, src, dst))
+    except generatemetro.UnknownStationError as e:
+        raise HttpError(404, str(e))
+    except (generatemetro.MetroError, ValueError, TypeError) as e:
+        raise HttpError(400, str(e))
+
+
+def batch_query(city, pairs, depart=None):
+    results = []
+    for pair in pairs:
+        try:
+            results.append(route_query(city, pair[0], pair[1], depart))
+        except HttpError as e:
+            results.append({'error': e.message})
+    return results
+
+
+def nearest_query(city, lat, lon, k=5, radius=None, to=None):
+    metro = _Metro(city)
+    try:
+        found = metro.Within(lat, lon, radius) if radius is not None else metro.Nearest(lat, lon, k)
+    except generatemetro.MetroError as e:
+        raise HttpError(400, str(e))
+    stations = []
+    for id, meters in found:
+        station = {'id': id, 'name': metro.GetStation(id).name, 'distance': round(meters, 1)}
+        if to is not None:
+            try:
+                route = _cache.Route(metro, id, to)
+            except generatemetro.UnknownStationError as e:
+                raise HttpError(404, str(e))
+            station['time'] = None if route is None else route.time
+        stations.append(station)
+    return stations
+
+
+def search_query(query, city=None, limit=10):
+    metros = sorted(_metros.items()) if city is None else [(city, _Metro(city))]
+    # matches name the city by Metro.id, the other endpoints take the city key
+    keys = {metro.id: key for key, metro in metros}
+    matches = generatemetro.search_stations([metro.SearchIndex() for _, metro in metros], query, limit)
+    return [match._replace(city=keys[match.city])._asdict() for match in matches]
+
+
+def stations_query(city=None):
+    if city is None:
+        return [{'id': key, 'name': metro.name, 'stations': len(metro._ids)} for key, metro in sorted(_metros.items())]
+    metro = _Metro(city)
+    return [{'id': station.id, 'name': station.name, 'line': line.id, 'x': station.x, 'y': station.y,
+             'lat': station.lat, 'lon': station.lon}
+            for line in metro.lines.values() for station in line.stations.values()]
+
+
+class MetroServer(object):
+    def __init__(self, executor=None, workers=1):
+        # CPU-bound searches go to executor, None runs them inline on the event loop
+        self.executor = executor
+        self.workers = workers
+
+    async def _Run(self, function, *args):
+        if self.executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _Batch(self, city, pairs, depart):
+        # split big batches over the pool
+        size = max(1, -(-len(pairs) // self.workers))
+        chunks = await asyncio.gather(*[self._Run(batch_query, city, pairs[i:i + size], depart)
+                                        for i in range(0, len(pairs), size)])
+        return [result for chunk in chunks for result in chunk]
+
+    async def Handle(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+
+        def param(name, convert=str, default=None, required=True):
+            if name not in params:
+                if required and default is None:
+                    raise HttpError(400, "Missing '{}' parameter".format(name))
+                return default
+            try:
+                return convert(params[name])
+            except ValueError:
+                raise HttpError(400, "Bad '{}' parameter".format(name))
+
+        if url.path == '/stations':
+            if method != 'GET':
+                raise HttpError(405, 'Use GET')
+            return stations_query(params.get('city'))
+        if url.path == '/search':
+            if method != 'GET':
+                raise HttpError(405, 'Use GET')
+            return search_query(param('q'), param('city', required=False), param('limit', int, 10))
+        if url.path == '/nearest':
+            if method != 'GET':
+                raise HttpError(405, 'Use GET')
+            args = (param('city'), param('lat', float), param('lon', float), param('k', int, 5),
+                    param('radius', float, required=False), param('to', required=False))
+            if args[-1] is None:
+                return nearest_query(*args)
+            return await self._Run(nearest_query, *args)
+        if url.path == '/route':
+            if method == 'GET':
+                alternatives = param('alternatives', int, 0)
+                if not 0 <= alternatives <= MAX_ALTERNATIVES:
+                    raise HttpError(400, "'alternatives' must be between 0 and {}".format(MAX_ALTERNATIVES))
+                return await self._Run(route_query, param('city'), param('from'), param('to'),
+                                       param('depart', required=False), param('pareto', int, 0) == 1,
+                                       alternatives)
+            if method == 'POST':
+                try:
+                    request = json.loads(body.decode('utf-8'))
+                    city = request['city']
+                    pairs = [(str(src), str(dst)) for src, dst in request['pairs']]
+                except (ValueError, KeyError, TypeError):
+                    raise HttpError(400, "Expected {\"city\": ..., \"pairs\": [[from, to], ...]}")
+                if len(pairs) > MAX_BATCH:
+                    raise HttpError(413, 'At most {} pairs per batch'.format(MAX_BATCH))
+                depart = request.get('depart')
+                if depart is not None and (isinstance(depart, bool) or not isinstance(depart, (str, int))):
+                    raise HttpError(400, "'depart' must be \"HH:MM[:SS]\" or seconds")
+                _Metro(city)
+                return await self._Batch(city, pairs, depart)
+            raise HttpError(405, 'Use GET or POST')
+        raise HttpError(404, "Unknown path '{}'".format(url.path))
+
+    async def Serve(self, reader, writer):
+        # one connection, requests are answered in order until either side closes it
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._Respond(writer, 400, {'error': 'Bad request line'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._Respond(writer, 400, {'error': 'Bad Content-Length'}, False)
+                    break
+                if length > MAX_BODY:
+                    await self._Respond(writer, 413, {'error': 'Body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, result = 200, await self.Handle(method, target, body)
+                except HttpError as e:
+                    status, result = e.status, {'error': e.message}
+                except Exception as e:
+                    status, result = 500, {'error': repr(e)}
+                await self._Respond(writer, status, result, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _Respond(self, writer, status, result, keep_alive):
+        payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\n'
+                     'Content-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                         status, REASONS[status], len(payload), 'keep-alive' if keep_alive else 'close'
+                     ).encode('latin-1') + payload)
+        await writer.drain()
+
+
+async def serve(host, port, jobs, cities_dir):
+    load_cities(cities_dir)
+    executor = None
+    if jobs > 0:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=load_cities,
+                                                          initargs=(cities_dir,))
+    server = await asyncio.start_server(MetroServer(executor, max(jobs, 1)).Serve, host, port)
+    print('Serving {} on {}'.format(', '.join(sorted(_metros)),
+                                    ', '.join('{}:{}'.format(*sock.getsockname()[:2]) for sock in server.sockets)))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve routes, nearest stations and station lists over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='worker processes for route searches, 0 runs them on the event loop')
+    parser.add_argument('--cities-dir', default=generatemetro.CITIES_DIR)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.jobs, args.cities_dir))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
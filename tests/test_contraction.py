@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# The contraction hierarchy must give the same travel times as the plain Dijkstra search.
+#
+#   python -m pytest tests    or    python -m unittest discover tests
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generatemetro  # noqa: E402
+
+
+class ContractionHierarchyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='metro-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameRoute(self, metro, fast, slow, src, dst):
+        if slow is None:
+            self.assertIsNone(fast, (src, dst))
+            return
+        self.assertEqual(fast.time, slow.time, (src, dst))
+        self.assertEqual((fast.stations[0], fast.stations[-1]), (src, dst))
+        # the fast route may take another, equally fast way, but over existing segments only
+        changes = set(fast.transfers)
+        total = 0
+        for st1, st2 in zip(fast.stations, fast.stations[1:]):
+            edges = metro.changes if (st1, st2) in changes else metro.times
+            total += edges['{}@{}'.format(st1, st2)]
+        self.assertEqual(total, fast.time, (src, dst))
+
+    def test_fast_route_matches_route(self):
+        for city in generatemetro.city_names():
+            metro = generatemetro.get_metro(city)
+            for src in metro._ids:
+                for dst in metro._ids:
+                    self.assertSameRoute(metro, metro.FastRoute(src, dst), metro.Route(src, dst), src, dst)
+
+    def test_rebuilt_after_changes(self):
+        metro = generatemetro.load_metro(os.path.join(generatemetro.CITIES_DIR, 'piter.json'))
+        src, dst = metro._ids[0], metro._ids[-1]
+        before = metro.FastRoute(src, dst)
+        metro.AddChange(src, dst, 60)
+        self.assertEqual(metro.FastRoute(src, dst).time, 60)
+        self.assertLess(60, before.time)
+
+    def test_disconnected(self):
+        metro = generatemetro.Metro('test', 'Test', 'Test')
+        metro.AddLine('a', 'A', '#000').AddStations([('a1', 'A1', 0, 0, 55.70, 37.60), ('a2', 'A2', 0, 0, 55.71, 37.60)])
+        metro.AddLine('b', 'B', '#fff').AddStations([('b1', 'B1', 0, 0, 55.80, 37.60), ('b2', 'B2', 0, 0, 55.81, 37.60)])
+        metro.FillDefaultTimes()
+        self.assertIsNone(metro.FastRoute('a1', 'b2'))
+        self.assertEqual(metro.FastRoute('a2', 'a2').stations, ['a2'])
+        self.assertEqual(metro.FastRoute('b1', 'b2'), metro.Route('b1', 'b2'))
+
+    def test_round_trip(self):
+        for city in generatemetro.city_names():
+            metro = generatemetro.get_metro(city)
+            path = os.path.join(self.directory, '{}.ch'.format(city))
+            self.assertTrue(generatemetro.write_contraction_hierarchy(metro, path))
+            self.assertFalse(generatemetro.write_contraction_hierarchy(metro, path))
+            built = metro.ContractionHierarchy()
+            loaded = generatemetro.load_contraction_hierarchy(path)
+            self.assertEqual(loaded.ids, built.ids)
+            for name in ('rank', '_offsets', '_targets', '_weights', '_middles'):
+                self.assertEqual(list(getattr(loaded, name)), list(getattr(built, name)), name)
+            ids = metro._ids
+            for src in ids[::5]:
+                for dst in ids[::3]:
+                    self.assertEqual(loaded.Route(src, dst), built.Route(src, dst))
+
+    def test_load_rejects_other_files(self):
+        path = os.path.join(self.directory, 'moscow.matrix')
+        generatemetro.write_time_matrix(generatemetro.get_metro('kazan'), path)
+        with self.assertRaises(generatemetro.MetroError):
+            generatemetro.load_contraction_hierarchy(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Metro.EarliestArrival waits for trains and out of closures instead of giving up.
+#
+#   python -m pytest tests    or    python -m unittest discover tests
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generatemetro  # noqa: E402
+
+
+def two_lines():
+    # a1 -100 s- a2 -100 s- a3 with a train every 5 minutes from 09:00 to 11:00,
+    # a2 -120 s change- b1 -60 s- b2 running all the time
+    metro = generatemetro.Metro('test', 'Test', 'Test')
+    metro.AddLine('a', 'A', '#ff0000').AddStations([
+        ('a1', 'A1', 0, 0, 55.70, 37.60),
+        ('a2', 'A2', 0, 0, 55.71, 37.60),
+        ('a3', 'A3', 0, 0, 55.72, 37.60),
+    ])
+    metro.AddLine('b', 'B', '#0000ff').AddStations([
+        ('b1', 'B1', 0, 0, 55.71, 37.61),
+        ('b2', 'B2', 0, 0, 55.71, 37.62),
+    ])
+    metro.FillDefaultTimes()
+    metro.AddChange('a2', 'b1', 120)
+    metro.SetHeadways('a', [('09:00', '11:00', 300)])
+    return metro
+
+
+def clock(value):
+    return generatemetro.parse_clock(value)
+
+
+class EarliestArrivalTest(unittest.TestCase):
+    def setUp(self):
+        self.metro = two_lines()
+        self.assertEqual(self.metro.times['a1@a2'], 100)
+        self.assertEqual(self.metro.times['b1@b2'], 60)
+
+    def assertArrival(self, src, dst, departure, arrival):
+        journey = self.metro.EarliestArrival(src, dst, departure)
+        self.assertIsNotNone(journey, (src, dst, departure))
+        self.assertEqual(journey.arrival, clock(arrival), (src, dst, departure))
+        return journey
+
+    def test_waits_for_next_train(self):
+        self.assertArrival('a1', 'a3', '09:58', '10:03:20')
+        self.assertArrival('a1', 'a3', '10:00', '10:03:20')
+        self.assertArrival('a1', 'a3', '10:00:01', '10:08:20')
+
+    def test_no_train_after_service(self):
+        self.assertIsNone(self.metro.EarliestArrival('a1', 'a3', '11:01'))
+
+    def test_line_without_headways_leaves_at_once(self):
+        self.assertArrival('b1', 'b2', '03:00', '03:01')
+
+    def test_change_to_line_without_headways(self):
+        journey = self.assertArrival('a1', 'b2', '09:58', '10:04:40')
+        self.assertEqual(journey.stations, ['a1', 'a2', 'b1', 'b2'])
+        self.assertEqual(journey.transfers, [('a2', 'b1')])
+
+    def test_closed_ride_segment_takes_train_after_reopening(self):
+        self.metro.CloseSegment('a1', 'a2', '10:00', '10:10')
+        self.assertArrival('a1', 'a3', '09:58', '10:13:20')
+
+    def test_closed_ride_segment_holds_train(self):
+        self.metro.CloseSegment('a2', 'a3', '10:00', '10:10')
+        self.assertArrival('a1', 'a3', '09:58', '10:11:40')
+
+    def test_closed_change_waits(self):
+        self.metro.CloseSegment('a2', 'b1', '10:00', '10:05')
+        journey = self.assertArrival('a1', 'b2', '09:58', '10:08')
+        self.assertEqual(journey.transfers, [('a2', 'b1')])
+
+    def test_closed_change_station_waits(self):
+        self.metro.CloseStation('b1', '10:00', '10:05')
+        self.assertArrival('a2', 'b2', '09:59', '10:06')
+
+    def test_closed_station_is_passed_through(self):
+        self.metro.CloseStation('a2', '09:55', '10:10')
+        self.assertArrival('a1', 'a3', '09:58', '10:03:20')
+
+    def test_closed_destination_waits_to_get_off(self):
+        self.metro.CloseStation('a2', '09:55', '10:10')
+        self.assertArrival('a1', 'a2', '09:58', '10:10')
+
+    def test_closed_source_departs_after_reopening(self):
+        self.metro.CloseStation('a1', '10:00', '10:07')
+        self.assertArrival('a1', 'a3', '10:01', '10:13:20')
+
+
+if __name__ == '__main__':
+    unittest.main()
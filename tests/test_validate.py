@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# validate_definition reports every kind of problem instead of crashing on it.
+#
+#   python -m pytest tests    or    python -m unittest discover tests
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generatemetro  # noqa: E402
+
+
+def definition():
+    # two lines of two stations each, joined by a change at a2 and b1
+    return {
+        'id': 'test',
+        'name': 'Test',
+        'accusative_name': 'Test',
+        'lines': [
+            {'id': 'a', 'name': 'A', 'color': '#ff0000', 'stations': [
+                ['a1', 'A1', 0, 0, 55.70, 37.60],
+                ['a2', 'A2', 0, 0, 55.71, 37.60],
+            ]},
+            {'id': 'b', 'name': 'B', 'color': '#0000ff', 'stations': [
+                ['b1', 'B1', 0, 0, 55.71, 37.61],
+                ['b2', 'B2', 0, 0, 55.71, 37.62],
+            ]},
+        ],
+        'changes': [['a2', 'b1', 120]],
+    }
+
+
+class ValidateDefinitionTest(unittest.TestCase):
+    def assertProblems(self, definition, *kinds):
+        problems = generatemetro.validate_definition(definition)
+        self.assertEqual(sorted(problem.kind for problem in problems), sorted(kinds), problems)
+
+    def test_valid(self):
+        self.assertProblems(definition())
+
+    def test_cities(self):
+        for city in generatemetro.city_names():
+            self.assertEqual(generatemetro.validate_metro(generatemetro.get_metro(city)), [], city)
+
+    def test_bad_station(self):
+        for row in (['a3', 'A3', 0, 0, 55.72], ['a3', 'A3', 0, 0, '55.72', 37.60], ['a3', 'A3', 0, 0, 55.72, True],
+                    [None, 'A3', 0, 0, 55.72, 37.60], 'a3'):
+            metro = definition()
+            metro['lines'][0]['stations'].append(row)
+            self.assertProblems(metro, 'bad_station')
+        metro = definition()
+        metro['lines'][0]['branch'] = [['a3', 'A3', 0, 0]]
+        self.assertProblems(metro, 'bad_station')
+
+    def test_duplicate_station(self):
+        metro = definition()
+        metro['lines'][1]['stations'].append(['a1', 'A1', 0, 0, 55.70, 37.60])
+        self.assertProblems(metro, 'duplicate_station')
+
+    def test_bad_change(self):
+        for change in (['a2'], ['a2', 'b1', 120, 1], ['a2', 'b1', '120'], ['a2', 'b1', 1.5], ['a2', 'b1', -1],
+                       [['a2'], 'b1'], 'a2b1'):
+            metro = definition()
+            metro['changes'].append(change)
+            self.assertProblems(metro, 'bad_change')
+
+    def test_unknown_station(self):
+        metro = definition()
+        metro['changes'].append(['a1', 'c1'])
+        metro['times'] = [['a1', 'c2']]
+        metro['closures'] = {'stations': [['c3', '10:00', '10:10']]}
+        self.assertProblems(metro, 'unknown_station', 'unknown_station', 'unknown_station')
+
+    def test_asymmetric_time(self):
+        metro = definition()
+        metro['changes'].append(['b1', 'a2', 180])
+        self.assertProblems(metro, 'asymmetric_time')
+
+    def test_bad_time(self):
+        for time in (['a1'], ['a1', 'a2', 41, 1], ['a1', 'a2', 0], ['a1', 'a2', 'fast'], [1, 'a2']):
+            metro = definition()
+            metro['times'] = [time]
+            self.assertProblems(metro, 'bad_time')
+
+    def test_duplicate_line(self):
+        metro = definition()
+        metro['lines'].append({'id': 'a', 'name': 'A', 'color': '#ff0000', 'stations': []})
+        self.assertProblems(metro, 'duplicate_line')
+
+    def test_bad_clock(self):
+        metro = definition()
+        metro['closures'] = {'stations': [['a1', '10h', '10:10']]}
+        self.assertProblems(metro, 'bad_clock')
+        metro = definition()
+        metro['lines'][0]['headways'] = [['09:00', '11:00', {}]]
+        self.assertProblems(metro, 'bad_clock')
+
+    def test_bad_headway(self):
+        for window in (['09:00', '11:00'], ['11:00', '09:00', 300], ['09:00', '11:00', 0], 300):
+            metro = definition()
+            metro['lines'][0]['headways'] = [window]
+            self.assertProblems(metro, 'bad_headway')
+
+    def test_bad_closure(self):
+        metro = definition()
+        metro['closures'] = {'stations': [['a1', '10:00']], 'segments': [['a1', '10:00', '10:10'], [['a1'], 'a2', 0, 1]]}
+        self.assertProblems(metro, 'bad_closure', 'bad_closure', 'bad_closure')
+
+    def test_invalid(self):
+        metro = definition()
+        metro['closures'] = {'segments': [['a1', 'b2', '10:00', '10:10']]}
+        self.assertProblems(metro, 'invalid')
+
+    def test_zero_time(self):
+        metro = definition()
+        metro['lines'][0]['stations'][1][4] = 55.70
+        self.assertProblems(metro, 'zero_time')
+
+    def test_absurd_time(self):
+        metro = definition()
+        metro['lines'][0]['stations'][1][4] = 56.70
+        self.assertProblems(metro, 'absurd_time')
+
+    def test_orphan_change(self):
+        metro = definition()
+        metro['changes'].append(['a1', 'a2'])
+        self.assertProblems(metro, 'orphan_change')
+
+    def test_disconnected(self):
+        metro = definition()
+        metro['changes'] = []
+        self.assertProblems(metro, 'disconnected')
+
+
+if __name__ == '__main__':
+    unittest.main()